@@ -1,6 +1,9 @@
 import { find_get_parameter } from "./utils.js";
 
-let page_info_json;
+// Info about how the page info is split up, from comic/page_info/index.json
+let page_info_index;
+// Chunks of page info that have been fetched (or are being fetched), by chunk number
+let page_info_chunks = {};
 let infinite_scroll_div;
 let earliest_comic_loaded = null;
 let latest_comic_loaded = null;
@@ -12,90 +15,242 @@ let loading_more_pages = false;
 // it counts as being "viewed" for the purposes of determining what the current viewed page is.
 let viewed_page_top_margin_percentage = 0.30;
 let load_next_pages_threshold = 1000;
+// Only pages within this distance of the viewport (by percentage of the viewport height) have their images in the
+// page. Pages further away are emptied out and left as placeholders of the same size, so reading hundreds of pages in a
+// row doesn't keep hundreds of full size images in memory.
+let render_margin_percentage = 200;
+// How many images after the last loaded page to start downloading ahead of time, so they're ready when the reader
+// scrolls down to them
+let num_images_to_prefetch = 3;
+// The page info for every page in the infinite scroll div, by page number
+let loaded_pages = new Map();
+let prefetched_pages = new Set();
+// These are left as null in browsers without IntersectionObserver. Every page stays rendered in them, and newer pages
+// are loaded with the Load Newer button.
+let render_observer = null;
+let current_page_observer = null;
+let load_newer_observer = null;
 
 export async function load_page() {
     initializing = true;
-    await fetch_all_json_data();
+    await fetch_page_info_index();
     infinite_scroll_div = document.getElementById("infinite-scroll");
-    load_and_go_to_page();
+    create_observers();
+    await load_and_go_to_page();
     document.getElementById("load-older-button").onclick = load_older_pages;
     document.getElementById("load-newer-button").onclick = load_newer_pages;
-    window.onscroll = on_scroll;
-    // document.addEventListener("keydown", event => {
-    //     if (event.code === "KeyL") {
-    //         set_current_page(get_current_page(current_page, true));
-    //     }
-    // });
     for (let link of document.getElementsByClassName("chapter-links")) {
-        link.addEventListener("click", function () {
+        link.addEventListener("click", async function () {
             let url = this.getAttribute("href");
-            console.log(url);
             window.location.href = url;
             initializing = true;
-            infinite_scroll_div.textContent = '';
-            load_and_go_to_page();
+            reset_pages();
+            await load_and_go_to_page();
             initializing = false;
+            watch_for_newer_pages();
         })
     }
     initializing = false;
+    watch_for_newer_pages();
 }
 
-async function fetch_all_json_data() {
-    let response = await fetch("../comic/page_info_list.json");
-    console.log("Fetched page info list");
-    let json = await response.json();
-    page_info_json = json["page_info_list"];
+function create_observers() {
+    if (!("IntersectionObserver" in window)) {
+        return;
+    }
+    render_observer = new IntersectionObserver(entries => {
+        for (let entry of entries) {
+            if (entry.isIntersecting) {
+                render_page(entry.target);
+            } else {
+                recycle_page(entry.target);
+            }
+        }
+    }, {rootMargin: render_margin_percentage + "% 0px"});
+    // Only the page that crosses the line at viewed_page_top_margin_percentage down the viewport is the current page
+    let top_margin = viewed_page_top_margin_percentage * 100;
+    current_page_observer = new IntersectionObserver(entries => {
+        if (initializing) {
+            return;
+        }
+        for (let entry of entries) {
+            if (entry.isIntersecting) {
+                set_current_page(entry.target);
+            }
+        }
+    }, {rootMargin: "-" + top_margin + "% 0px -" + (99 - top_margin) + "% 0px"});
+    load_newer_observer = new IntersectionObserver(entries => {
+        if (!initializing && entries[entries.length - 1].isIntersecting) {
+            load_newer_pages();
+        }
+    }, {rootMargin: "0px 0px " + load_next_pages_threshold + "px 0px"});
+}
+
+function watch_for_newer_pages() {
+    if (load_newer_observer === null) {
+        return;
+    }
+    // Observing the button again always calls the observer, so more pages get loaded if it's still close to the
+    // viewport after the last ones were added
+    let load_newer_div = document.getElementById("load-newer");
+    load_newer_observer.unobserve(load_newer_div);
+    load_newer_observer.observe(load_newer_div);
+}
+
+function reset_pages() {
+    if (render_observer !== null) {
+        render_observer.disconnect();
+        current_page_observer.disconnect();
+    }
+    infinite_scroll_div.textContent = '';
+    loaded_pages.clear();
+    current_page = null;
+    document.getElementById("load-older").hidden = true;
+    document.getElementById("load-newer").hidden = false;
+    document.getElementById("caught-up-notification").hidden = true;
+}
+
+async function fetch_page_info_index() {
+    let response = await fetch("../comic/page_info/index.json");
+    page_info_index = await response.json();
 }
 
-function load_and_go_to_page() {
-    get_starting_page();
-    load_newer_pages();
+function fetch_page_info_chunk(chunk_number) {
+    if (!(chunk_number in page_info_chunks)) {
+        page_info_chunks[chunk_number] = fetch("../comic/page_info/chunk_" + chunk_number + ".json")
+            .then(response => response.json());
+    }
+    return page_info_chunks[chunk_number];
+}
+
+async function get_page_info(page_number) {
+    let chunk_size = page_info_index["chunk_size"];
+    let chunk_number = Math.floor(page_number / chunk_size);
+    let chunk = await fetch_page_info_chunk(chunk_number);
+    // Start fetching the next chunk in the background before it's needed, so scrolling doesn't have to wait for it
+    if (page_number % chunk_size >= chunk_size / 2 && chunk_number + 1 < page_info_index["chunk_count"]) {
+        fetch_page_info_chunk(chunk_number + 1);
+    }
+    return chunk[page_number % chunk_size];
+}
+
+// Must match get_lookup_bucket() in src/scripts/build_site.py
+function get_lookup_bucket(page_name, bucket_count) {
+    let h = 0;
+    for (let i = 0; i < page_name.length; i++) {
+        h = (Math.imul(h, 31) + page_name.charCodeAt(i)) >>> 0;
+    }
+    return h % bucket_count;
+}
+
+async function get_page_number(page_name) {
+    let bucket = get_lookup_bucket(page_name, page_info_index["lookup_bucket_count"]);
+    let response = await fetch("../comic/page_info/lookup_" + bucket + ".json");
+    let lookup = await response.json();
+    return page_name in lookup ? lookup[page_name] : null;
+}
+
+async function load_and_go_to_page() {
+    await get_starting_page();
+    await load_newer_pages();
     go_to_anchor();
 }
 
-function get_starting_page() {
+async function get_starting_page() {
     earliest_comic_loaded = 0;
     latest_comic_loaded = -1;
     if (!window.location.href.includes("#")) {
         return;
     }
-    let page_name = window.location.href.split("#")[1];
-    console.log("Loading page named " + page_name);
-    for (let i=0; i < page_info_json.length; i++) {
-        console.log(page_info_json[i].page_name);
-        if (page_info_json[i].page_name === page_name) {
-            console.log("Starting on page " + i);
-            if (i !== 0) {
-                document.getElementById("load-older").hidden = false;
-            }
-            earliest_comic_loaded = i;
-            latest_comic_loaded = i - 1;
-            return;
-        }
+    let page_name = decodeURIComponent(window.location.href.split("#")[1]);
+    let i = await get_page_number(page_name);
+    if (i === null) {
+        console.log("Couldn't find page named " + page_name);
+        return;
+    }
+    if (i !== 0) {
+        document.getElementById("load-older").hidden = false;
+    }
+    earliest_comic_loaded = i;
+    latest_comic_loaded = i - 1;
+}
+
+function set_image_sources(image_node, page) {
+    let src = "../your_content/comics/" + page["page_name"] + "/" + page["Filename"];
+    if (page["image_variants"] && page["image_variants"].length) {
+        // Let the browser pick the smallest version of the image that still looks sharp on this screen
+        let sources = page["image_variants"].map(variant => "../" + variant["path"] + " " + variant["width"] + "w");
+        sources.push(src + " " + page["image_width"] + "w");
+        image_node.sizes = "(max-width: " + page["image_width"] + "px) 100vw, " + page["image_width"] + "px";
+        image_node.srcset = sources.join(", ");
     }
-    console.log("Couldn't find page named " + page_name);
+    image_node.src = src;
 }
 
-function build_comic_div(page) {
+function build_comic_div(page, page_number) {
     let node = document.createElement("div");
     node.className = "infinite-page";
     node.id = page["page_name"];
+    node.dataset.pageNumber = page_number;
+    loaded_pages.set(page_number, page);
+    render_page(node);
+    return node;
+}
 
+function render_page(node) {
+    if (node.firstChild) {
+        return;
+    }
+    let page = loaded_pages.get(Number(node.dataset.pageNumber));
     let link_node = document.createElement("a");
     link_node.href = "comic/" + page["page_name"] + ".html";
 
     let image_node = document.createElement("img");
     image_node.className = "infinite-page-image";
-    console.log("Adding div for page " + page["page_name"]);
-    image_node.src = "../your_content/comics/" + page["page_name"] + "/" + page["Filename"];
     image_node.title = page["Alt text"];
+    if (page["image_width"] && page["image_height"]) {
+        // Reserves the right amount of space for the image before it loads, so the pages below it don't jump around
+        image_node.width = page["image_width"];
+        image_node.height = page["image_height"];
+    }
+    set_image_sources(image_node, page);
 
     link_node.appendChild(image_node);
     node.appendChild(link_node);
-    return node;
+    // The image takes up the same space as the placeholder did, so the placeholder's height isn't needed anymore
+    node.style.height = "";
+}
+
+function recycle_page(node) {
+    if (!node.firstChild) {
+        return;
+    }
+    // Keep the page's height, so nothing around it moves when its image is removed
+    node.style.boxSizing = "border-box";
+    node.style.height = node.offsetHeight + "px";
+    node.textContent = '';
 }
 
-function load_older_pages() {
+function add_page_node(node, before_node=null) {
+    infinite_scroll_div.insertBefore(node, before_node);
+    if (render_observer !== null) {
+        render_observer.observe(node);
+        current_page_observer.observe(node);
+    }
+}
+
+function prefetch_images() {
+    let page_count = page_info_index["page_count"];
+    for (let i = latest_comic_loaded + 1; i <= latest_comic_loaded + num_images_to_prefetch && i < page_count; i++) {
+        if (prefetched_pages.has(i)) {
+            continue;
+        }
+        prefetched_pages.add(i);
+        get_page_info(i).then(page => set_image_sources(new Image(), page));
+    }
+}
+
+async function load_older_pages() {
     if (earliest_comic_loaded <= 0) {
         // No more pages to display
         return;
@@ -106,10 +261,9 @@ function load_older_pages() {
     try {
         for (let i = 0; i < num_pages_to_load; i++) {
             earliest_comic_loaded--;
-            current_page++;
 
-            let node = build_comic_div(page_info_json[earliest_comic_loaded]);
-            infinite_scroll_div.insertBefore(node, infinite_scroll_div.firstChild);
+            let node = build_comic_div(await get_page_info(earliest_comic_loaded), earliest_comic_loaded);
+            add_page_node(node, infinite_scroll_div.firstChild);
 
             if (earliest_comic_loaded <= 0) {
                 // No more pages to display
@@ -122,8 +276,8 @@ function load_older_pages() {
     }
 }
 
-function load_newer_pages() {
-    if (latest_comic_loaded + 1 >= page_info_json.length) {
+async function load_newer_pages() {
+    if (latest_comic_loaded + 1 >= page_info_index["page_count"]) {
         // No more pages to display
         return;
     }
@@ -135,71 +289,44 @@ function load_newer_pages() {
         for (let i = 0; i < num_pages_to_load; i++) {
             latest_comic_loaded++;
 
-            let node = build_comic_div(page_info_json[latest_comic_loaded]);
-            infinite_scroll_div.appendChild(node);
+            let node = build_comic_div(await get_page_info(latest_comic_loaded), latest_comic_loaded);
+            add_page_node(node);
 
-            if (latest_comic_loaded + 1 >= page_info_json.length) {
+            if (latest_comic_loaded + 1 >= page_info_index["page_count"]) {
                 // No more pages to display
                 document.getElementById("load-newer").hidden = true;
                 document.getElementById("caught-up-notification").hidden = false;
                 break;
             }
         }
-        console.log("Done loading images");
+        prefetch_images();
     } finally {
         loading_more_pages = false;
     }
+    if (!initializing) {
+        watch_for_newer_pages();
+    }
 }
 
 function go_to_anchor() {
     if (!window.location.href.includes("#")) {
         return;
     }
-    let anchor = window.location.href.split("#")[1];
-    let top = document.getElementById(anchor).offsetTop;
-    window.scrollTo(0, top);
-}
-
-function get_current_page(start_at_page, show_logs=false) {
-    if (start_at_page === null) {
-        start_at_page = 0;
-    }
-    let child_nodes = infinite_scroll_div.childNodes;
-    let threshold = viewed_page_top_margin_percentage * window.innerHeight;
-    if (show_logs) {
-        console.log("childNodes length: " + child_nodes.length);
-        console.log(threshold);
-    }
-    for (let i=start_at_page; i < child_nodes.length; i++) {
-        let rect = child_nodes[i].getBoundingClientRect();
-        if (show_logs)
-            console.log("id=" + child_nodes[i].id + ", top=" + rect.top);
-        if (rect.top >= threshold) {
-            return Math.max(0, i - 1);
-        }
+    let anchor = decodeURIComponent(window.location.href.split("#")[1]);
+    let node = document.getElementById(anchor);
+    if (node === null) {
+        return;
     }
-    return child_nodes.length - 1;
+    window.scrollTo(0, node.offsetTop);
+    current_page = Number(node.dataset.pageNumber);
 }
 
-function set_current_page(new_current_page) {
-    current_page = new_current_page;
-    console.log("Current page: " + current_page);
-    let anchor = infinite_scroll_div.childNodes[current_page].id;
-    console.log("Anchor: " + anchor);
-    let new_url = window.location.href.split("#")[0] + "#" + anchor;
-    window.history.replaceState(null, null, new_url);
-}
-
-function on_scroll(event) {
-    if (initializing) {
+function set_current_page(node) {
+    let new_current_page = Number(node.dataset.pageNumber);
+    if (new_current_page === current_page) {
         return;
     }
-    if ((window.innerHeight + window.pageYOffset) >= document.body.offsetHeight - load_next_pages_threshold) {
-        load_newer_pages();
-    }
-
-    let new_current_page = get_current_page(current_page);
-    if (current_page !== new_current_page) {
-        set_current_page(new_current_page);
-    }
+    current_page = new_current_page;
+    let new_url = window.location.href.split("#")[0] + "#" + node.id;
+    window.history.replaceState(null, null, new_url);
 }
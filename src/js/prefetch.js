@@ -0,0 +1,23 @@
+// Kept around so the browser doesn't drop the download before it finishes
+let prefetched_image = null;
+
+// Downloads the next page's image once this page has finished loading, so it's already cached when the reader clicks
+// "Next". It's given the same srcset and sizes as the real image, so the browser picks the same size it'll show.
+export function prefetch_image(image) {
+    if (navigator.connection && navigator.connection.saveData) {
+        return;
+    }
+    let start = function() {
+        prefetched_image = new Image();
+        if (image["srcset"]) {
+            prefetched_image.sizes = image["sizes"];
+            prefetched_image.srcset = image["srcset"];
+        }
+        prefetched_image.src = image["src"];
+    };
+    if (document.readyState === "complete") {
+        start();
+    } else {
+        window.addEventListener("load", start);
+    }
+}
@@ -10,5 +10,29 @@ export function init() {
         for (let i = 0; i < transcripts.length; i++) {
             transcripts[i].style.display = i === languageList.selectedIndex ? "block" : null;
         }
+        load_transcript(transcripts[languageList.selectedIndex]);
     })
-}
\ No newline at end of file
+}
+
+// Only the first transcript is included in the comic page. The others are fetched the first time they're selected.
+function load_transcript(transcript) {
+    if (!transcript || !transcript.dataset.src || transcript.dataset.loaded) {
+        return;
+    }
+    transcript.dataset.loaded = "true";
+    fetch(transcript.dataset.src)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(response.status + " " + response.statusText);
+            }
+            return response.text();
+        })
+        .then(text => {
+            transcript.innerHTML = text;
+        })
+        .catch(error => {
+            console.log("Couldn't load transcript from " + transcript.dataset.src + ": " + error);
+            // Try again the next time it's selected
+            delete transcript.dataset.loaded;
+        });
+}
@@ -0,0 +1,190 @@
+"""
+A benchmark for the whole build. For each page count, it generates a synthetic comic archive (see load_test.py) in a
+temporary folder along with a copy of this site's src/ and your_content/ folders. Each run builds a fresh copy of that
+site with build_site.main() (a cold build, with no cache or manifest), then builds it again without changing anything
+(a warm build), and times each stage of both. The results are saved as JSON, so they can be compared between versions.
+
+Usage: python src/scripts/benchmark_build.py --pages 1000 10000 50000 [--runs 3] [--output benchmark_results.json]
+                                             [--compare old_results.json] [generator options...]
+Run with --help to see all the options.
+"""
+
+import os
+import platform
+import subprocess
+from argparse import ArgumentParser
+from configparser import RawConfigParser
+from contextlib import redirect_stdout
+from datetime import datetime
+from io import StringIO
+from json import dump, load
+from shutil import copytree, ignore_patterns, rmtree
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Dict, List
+
+import build_site
+from load_test import add_generator_arguments, generate_comic_pages, get_generator_settings
+
+REPO_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+
+def get_git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def set_up_site(site_dir: str, page_count: int, generator_settings: Dict, build_settings: List[str]):
+    """
+    Copies everything but the comic pages from this site into `site_dir`, then generates `page_count` comic pages.
+    :param build_settings: Extra comic_info.ini settings, in the form "Section.Option=value"
+    """
+    copytree(os.path.join(REPO_DIR, "src"), os.path.join(site_dir, "src"), ignore=ignore_patterns("__pycache__"))
+    copytree(os.path.join(REPO_DIR, "your_content"), os.path.join(site_dir, "your_content"),
+             ignore=ignore_patterns("comics"))
+    comic_info_path = os.path.join(site_dir, "your_content", "comic_info.ini")
+    comic_info = RawConfigParser()
+    comic_info.optionxform = str
+    comic_info.read(comic_info_path, encoding="utf-8")
+    # Build the site as if it's being built locally
+    comic_info.set("Comic Info", "Comic domain", "http://localhost")
+    comic_info.set("Comic Info", "Comic subdirectory", "comic_git")
+    for setting in build_settings:
+        option, value = setting.split("=", 1)
+        section, option = option.split(".", 1)
+        if not comic_info.has_section(section):
+            comic_info.add_section(section)
+        comic_info.set(section, option, value)
+    with open(comic_info_path, "w", encoding="utf-8") as f:
+        comic_info.write(f)
+    generate_comic_pages(os.path.join(site_dir, "your_content", "comics"), page_count, **generator_settings)
+
+
+def run_build(build_args: List[str], verbose: bool) -> Dict[str, float]:
+    if verbose:
+        processing_times = build_site.main(build_args)
+    else:
+        # The build prints a line for every page, which would drown out the results
+        with redirect_stdout(StringIO()):
+            processing_times = build_site.main(build_args)
+    return dict(build_site.get_stage_times(processing_times))
+
+
+def get_medians(run_results: List[Dict[str, float]]) -> Dict[str, float]:
+    # Only the first run includes "Import build scripts", because the build scripts are only imported once
+    return {stage: median(run[stage] for run in run_results if stage in run) for stage in run_results[0]}
+
+
+def benchmark_page_count(page_count: int, runs: int, generator_settings: Dict, build_settings: List[str],
+                         build_args: List[str], verbose: bool) -> Dict:
+    cwd = os.getcwd()
+    with TemporaryDirectory() as temp_dir:
+        # The generated site is never built itself. Each run gets its own copy, so no run can use the cache,
+        # manifest, or reprocessed images left behind by an earlier one.
+        generated_dir = os.path.join(temp_dir, "generated")
+        start_time = perf_counter()
+        set_up_site(generated_dir, page_count, generator_settings, build_settings)
+        generate_seconds = perf_counter() - start_time
+        print(f"Generated {page_count} pages in {generate_seconds:.2f} s")
+        cold_results = []
+        warm_results = []
+        for run in range(1, runs + 1):
+            site_dir = os.path.join(temp_dir, f"run_{run}")
+            copytree(generated_dir, site_dir)
+            os.chdir(site_dir)
+            # Forget the templates compiled by the last run too, so they have to be compiled (or loaded from this
+            # copy's empty template cache) again
+            build_site.JINJA_ENVIRONMENT = None
+            try:
+                cold_results.append(run_build(build_args, verbose))
+                warm_results.append(run_build(build_args, verbose))
+            finally:
+                os.chdir(cwd)
+            rmtree(site_dir)
+            print(f"Run {run}: {cold_results[-1]['Total time']:.2f} s cold, "
+                  f"{warm_results[-1]['Total time']:.2f} s warm")
+    return {
+        "page_count": page_count,
+        "generate_seconds": generate_seconds,
+        "runs": cold_results,
+        "median": get_medians(cold_results),
+        "warm_runs": warm_results,
+        "warm_median": get_medians(warm_results),
+    }
+
+
+def print_comparison(baseline: Dict, results: Dict):
+    """
+    Prints how the median time of each stage changed since the baseline results, for each page count in both, for
+    both cold and warm builds. Results from before warm builds were timed only have the cold medians.
+    """
+    baseline_results = {r["page_count"]: r for r in baseline["results"]}
+    print("\nCompared to {} ({}):".format(baseline.get("version"), baseline.get("git_commit") or "unknown commit"))
+    for result in results["results"]:
+        if result["page_count"] not in baseline_results:
+            continue
+        baseline_result = baseline_results[result["page_count"]]
+        for key, build_type in (("median", "cold"), ("warm_median", "warm")):
+            if key not in baseline_result or key not in result:
+                continue
+            old_medians = baseline_result[key]
+            print(f"\n{result['page_count']} pages, {build_type} builds:")
+            for stage, seconds in result[key].items():
+                if stage not in old_medians:
+                    print("{}: {:.2f} ms (new)".format(stage, seconds * 1000))
+                    continue
+                old_seconds = old_medians[stage]
+                change = (seconds - old_seconds) / old_seconds * 100 if old_seconds else 0
+                print("{}: {:.2f} ms -> {:.2f} ms ({:+.1f}%)".format(stage, old_seconds * 1000, seconds * 1000,
+                                                                   change))
+
+
+def main():
+    parser = ArgumentParser(description="Benchmarks building a synthetic comic archive")
+    parser.add_argument("--pages", type=int, nargs="+", default=[1000], help="Page counts to benchmark")
+    parser.add_argument("--runs", type=int, default=3, help="Number of times to build each archive")
+    parser.add_argument("--output", default="benchmark_results.json", help="File to save the results in")
+    parser.add_argument("--compare", help="Results file from an earlier benchmark to compare the results against")
+    parser.add_argument("--set", action="append", default=[], metavar="SECTION.OPTION=VALUE",
+                        help='Change a comic_info.ini setting, e.g. --set "Build Settings.Render workers=0"')
+    parser.add_argument("--no-cache", action="store_true", help="Pass --no-cache to every build")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of each build")
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+
+    generator_settings = get_generator_settings(args)
+    build_args = ["--no-cache"] if args.no_cache else []
+    results = {
+        "version": build_site.VERSION,
+        "git_commit": get_git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "settings": {
+            "runs": args.runs,
+            "generator": generator_settings,
+            "comic_info": args.set,
+            "build_args": build_args,
+        },
+        "results": [],
+    }
+    for page_count in args.pages:
+        results["results"].append(
+            benchmark_page_count(page_count, args.runs, generator_settings, args.set, build_args, args.verbose)
+        )
+    with open(args.output, "w", encoding="utf-8") as f:
+        dump(results, f, indent=2)
+    print(f"Saved results to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(load(f), results)
+
+
+if __name__ == "__main__":
+    main()
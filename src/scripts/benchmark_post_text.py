@@ -0,0 +1,93 @@
+"""
+A benchmark for rendering post text. It compares the old way, where the shared "before post text.txt" and
+"after post text.txt" files were re-read and rendered along with every page's post.txt, with the new way, where they're
+rendered once per build and joined with each page's rendered post.
+
+Usage: python src/scripts/benchmark_post_text.py [page count]
+"""
+
+import os
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from build_site import SHARED_POST_TEXT_PATHS, compose_post_html, get_markdown, render_markdown_file
+
+BEFORE_POST_TEXT = """**New here?** Start from [the first page](/comic_git/comic/Page-1/), or check out the
+[archive](/comic_git/archive/) to jump to a chapter.
+
+---
+"""
+AFTER_POST_TEXT = """---
+
+Thanks for reading! If you'd like to support the comic, you can:
+
+* Support me on [Patreon](https://www.patreon.com/)
+* Buy prints and stickers in the [shop](https://shop.example.com/)
+* Follow me on [Twitter](https://twitter.com/) and [Instagram](https://instagram.com/)
+
+New pages go up every **Wednesday**. ~~No~~ Some exceptions.
+"""
+POST_TEXT = """Page {i} is up! This one took *forever* to color.
+
+Here's a paragraph about what's going on in the story, and [a link](https://example.com/{i}) to something fun.
+"""
+
+
+def generate_archive(page_count: int):
+    os.makedirs("your_content/comics")
+    with open(SHARED_POST_TEXT_PATHS[0], "w") as f:
+        f.write(BEFORE_POST_TEXT)
+    with open(SHARED_POST_TEXT_PATHS[1], "w") as f:
+        f.write(AFTER_POST_TEXT)
+    for i in range(1, page_count + 1):
+        os.makedirs(f"your_content/comics/Page-{i}")
+        with open(f"your_content/comics/Page-{i}/post.txt", "w") as f:
+            f.write(POST_TEXT.format(i=i))
+
+
+def render_per_page(page_count: int):
+    # How create_comic_data used to render post text
+    results = []
+    for i in range(1, page_count + 1):
+        post_html = []
+        for path in (SHARED_POST_TEXT_PATHS[0], f"your_content/comics/Page-{i}/post.txt", SHARED_POST_TEXT_PATHS[1]):
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    post_html.append(f.read().decode("utf-8"))
+        results.append(get_markdown().convert("\n\n".join(post_html)))
+    return results
+
+
+def render_shared_once(page_count: int):
+    before_html, after_html = (render_markdown_file(path) for path in SHARED_POST_TEXT_PATHS)
+    return [
+        compose_post_html(before_html, render_markdown_file(f"your_content/comics/Page-{i}/post.txt"), after_html)
+        for i in range(1, page_count + 1)
+    ]
+
+
+def main():
+    page_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    cwd = os.getcwd()
+    with TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        try:
+            generate_archive(page_count)
+            timings = {}
+            results = {}
+            for name, func in (("Before (per page)", render_per_page), ("After (shared once)", render_shared_once)):
+                start_time = perf_counter()
+                results[name] = func(page_count)
+                timings[name] = perf_counter() - start_time
+        finally:
+            os.chdir(cwd)
+    print(f"Rendered post text for {page_count} pages")
+    for name, t in timings.items():
+        print("{}: {:.2f} ms total, {:.3f} ms per page".format(name, t * 1000, t * 1000 / page_count))
+    before, after = results.values()
+    print("Identical output: {}".format(before == after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import os
+from hashlib import sha1
+from json import dumps, load
+from typing import Dict, List, Optional
+
+from content_index import get_stat
+
+# Files that speed up the next build, but aren't part of the site. This folder isn't committed or deployed, but the
+# GitHub workflow keeps it between builds.
+CACHE_DIRECTORY = ".build_cache"
+# The manifest holds the modification time of every input and output file, which changes on every checkout, so it's
+# kept with the cache instead of in the published comic folder
+MANIFEST_PATH = os.path.join(CACHE_DIRECTORY, "build_manifest.json")
+# Lists the output files that were added, modified, or removed by the last build, so deploys only have to upload those
+DEPLOY_DELTA_PATH = "comic/deploy_delta.json"
+# Bump this whenever the way keys are calculated changes, so old manifests are ignored instead of trusted
+MANIFEST_VERSION = 1
+
+
+def load_manifest(keep_outputs: bool = True, last_manifest: Dict = None) -> Dict:
+    """
+    Loads the manifest written by the last build, and returns a fresh manifest to record this build into. The last
+    build's manifest is kept under the "previous" key.
+    :param keep_outputs: If False, every output gets rebuilt. The previous build's outputs are still remembered, so
+    the ones this build doesn't write are deleted as stale. The file hash cache is kept either way.
+    :param last_manifest: The last build's manifest, if it's still in memory (e.g. in watch mode). If given, the
+    manifest isn't loaded from disk.
+    :return:
+    """
+    previous = {"files": {}, "outputs": {}, "images": {}, "compressed": {}, "output_files": {}}
+    if last_manifest is not None:
+        previous.update({k: last_manifest[k] for k in previous})
+    elif os.path.isfile(MANIFEST_PATH):
+        try:
+            with open(MANIFEST_PATH) as f:
+                loaded = load(f)
+        except ValueError:
+            print(f"Couldn't parse {MANIFEST_PATH}, ignoring it")
+        else:
+            if loaded.get("version") == MANIFEST_VERSION:
+                previous.update(loaded)
+    return {
+        "version": MANIFEST_VERSION,
+        "files": {},
+        "outputs": {},
+        "images": {},
+        "compressed": {},
+        "output_files": {},
+        "previous": previous,
+        "rebuild_all": not keep_outputs,
+    }
+
+
+def save_manifest(manifest: Dict):
+    os.makedirs(os.path.dirname(MANIFEST_PATH), exist_ok=True)
+    with open(MANIFEST_PATH, "w") as f:
+        f.write(dumps({
+            k: v for k, v in manifest.items() if k not in ("previous", "content_index", "rebuild_all")
+        }, sort_keys=True))
+
+
+def hash_file(manifest: Dict, path: str) -> Optional[str]:
+    """
+    Returns the SHA1 of the given file, or None if it doesn't exist. Hashes are cached in the manifest by file size and
+    modification time, so unchanged files (like large comic images) aren't read again on every build.
+    """
+    if path in manifest["files"]:
+        return manifest["files"][path][2]
+    # Use the content index from this build's scan of the content folders, if there is one
+    stat = get_stat(manifest.get("content_index"), path)
+    if stat is None:
+        return None
+    size, mtime_ns = stat
+    cached = manifest["previous"]["files"].get(path)
+    if cached and cached[0] == size and cached[1] == mtime_ns:
+        digest = cached[2]
+    else:
+        digest = sha1_file(path)
+    manifest["files"][path] = [size, mtime_ns, digest]
+    return digest
+
+
+def sha1_file(path: str) -> str:
+    h = sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_values(*values) -> str:
+    """
+    Returns a SHA1 of any JSON-serializable values. Used to combine file hashes and page data into a single key.
+    """
+    return sha1(dumps(values, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def needs_update(manifest: Dict, output_path: str, key: str) -> bool:
+    """
+    Records `key` as the key for `output_path` in this build, and returns True if the output has to be written, i.e.
+    it's missing on disk, the last build wrote it with a different key, or this build rebuilds everything.
+    """
+    manifest["outputs"][output_path] = key
+    if manifest["rebuild_all"] or manifest["previous"]["outputs"].get(output_path) != key:
+        return True
+    return not os.path.isfile(output_path)
+
+
+def add_output(manifest: Dict, output_path: str):
+    """
+    Records an output that's written on every build, so it's deleted as stale once a build stops writing it
+    """
+    manifest["outputs"][output_path] = ""
+
+
+def delete_stale_outputs(manifest: Dict):
+    """
+    Deletes any files written by the last build that weren't written or kept by this build, along with any directories
+    left empty by doing so.
+    """
+    for output_path in manifest["previous"]["outputs"]:
+        if output_path in manifest["outputs"]:
+            continue
+        if os.path.isfile(output_path):
+            print(f"Deleting stale file {output_path}")
+            os.remove(output_path)
+        dir_name = os.path.dirname(output_path)
+        if dir_name:
+            try:
+                os.removedirs(dir_name)
+            except OSError:
+                # Directory isn't empty
+                pass
+
+
+def record_output_files(manifest: Dict) -> Dict[str, List[str]]:
+    """
+    Records the size, modification time and SHA1 of every file this build wrote or kept, including reprocessed
+    images, and compares them to the last build's. Files are only hashed again if their size or modification time
+    changed, so a file that was rewritten with the same contents doesn't count as modified.
+    :return: A dict of "added", "modified", and "removed" to the output paths that changed since the last build
+    """
+    previous = manifest["previous"]["output_files"]
+    delta = {"added": [], "modified": [], "removed": []}
+    for output_path in sorted(set(manifest["outputs"]) | set(manifest["images"])):
+        try:
+            stat = os.stat(output_path)
+        except OSError:
+            continue
+        cached = previous.get(output_path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            digest = cached[2]
+        else:
+            digest = sha1_file(output_path)
+        manifest["output_files"][output_path] = [stat.st_size, stat.st_mtime_ns, digest]
+        if cached is None:
+            delta["added"].append(output_path)
+        elif cached[2] != digest:
+            delta["modified"].append(output_path)
+    # Files that are still there, but that this build didn't write (e.g. thumbnails, once thumbnails are turned off),
+    # are forgotten about without being listed as removed
+    delta["removed"] = sorted(
+        output_path for output_path in previous
+        if output_path not in manifest["output_files"] and not os.path.exists(output_path)
+    )
+    return delta
+
+
+def save_deploy_delta(delta: Dict[str, List[str]]):
+    os.makedirs(os.path.dirname(DEPLOY_DELTA_PATH), exist_ok=True)
+    with open(DEPLOY_DELTA_PATH, "w") as f:
+        f.write(dumps(delta, indent=2))
+    print("Output files: {} added, {} modified, {} removed".format(
+        len(delta["added"]), len(delta["modified"]), len(delta["removed"])
+    ))
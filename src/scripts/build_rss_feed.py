@@ -1,72 +1,102 @@
 import os
 from configparser import RawConfigParser
-from re import sub
-from time import strptime, strftime
-from typing import List, Dict
-from urllib.parse import urljoin
-from xml.dom import minidom
-from xml.etree import ElementTree
-from xml.etree.ElementTree import register_namespace
+from typing import Callable, Dict, Iterable, List, TextIO, Tuple
+from urllib.parse import quote, urljoin
 
+from build_manifest import hash_file, hash_values, needs_update
+from comic_page import ComicPage
+from compress_output import open_output_file
 from utils import get_comic_url
 
-cdata_dict = {}
+INDENT = "    "
+# The namespace of the <fh:archive/> element that marks a feed as an archived feed (RFC 5005)
+FEED_HISTORY_NAMESPACE = "http://purl.org/syndication/history/1.0"
 
 
-def add_base_tags_to_channel(channel, comic_url, comic_info):
-    atom_link = ElementTree.SubElement(channel, "{http://www.w3.org/2005/Atom}link")
-    atom_link.set("href", urljoin(comic_url, "feed.xml"))
-    atom_link.set("rel", "self")
-    atom_link.set("type", "application/rss+xml")
+def escape(text: str, entities: Dict[str, str] = None) -> str:
+    """
+    The same as xml.sax.saxutils.escape(), which is slow to import because it imports urllib.request
+    """
+    text = text.replace("&", "&amp;").replace(">", "&gt;").replace("<", "&lt;")
+    for character, entity in (entities or {}).items():
+        text = text.replace(character, entity)
+    return text
+
+
+def quote_attribute(value: str) -> str:
+    return '"{}"'.format(escape(value, {'"': "&quot;", "\n": "&#10;"}))
+
+
+def cdata(text: str) -> str:
+    # "]]>" can't appear inside a CDATA section, so split it across two sections
+    return "<![CDATA[{}]]>".format(text.replace("]]>", "]]]]><![CDATA[>"))
+
+
+def write_element(f: TextIO, depth: int, tag: str, text: str = None, raw_text: str = None, **attributes):
+    """
+    Writes a single element on its own line. `text` is escaped, `raw_text` is written as-is (e.g. for CDATA sections).
+    """
+    attribute_string = "".join(" {}={}".format(k, quote_attribute(v)) for k, v in attributes.items())
+    if raw_text is None:
+        raw_text = None if text is None else escape(text)
+    if raw_text is None:
+        f.write("{}<{}{}/>\n".format(INDENT * depth, tag, attribute_string))
+    else:
+        f.write("{}<{}{}>{}</{}>\n".format(INDENT * depth, tag, attribute_string, raw_text, tag))
+
+
+def get_feed_url(comic_url: str, feed_path: str) -> str:
+    # comic_url doesn't end with a slash, so urljoin() would replace the comic subdirectory instead of adding to it
+    return urljoin(comic_url + "/", quote(feed_path))
+
+
+def write_channel_tags(f: TextIO, comic_url: str, comic_info: RawConfigParser, title: str, feed_path: str,
+                       links: List[Tuple[str, str]]):
+    """
+    :param links: The relation and path of each feed this one links to, e.g. ("prev-archive", "feed/archive/1.xml")
+    """
+    for rel, path in [("self", feed_path)] + links:
+        write_element(f, 2, "atom:link", href=get_feed_url(comic_url, path), rel=rel, type="application/rss+xml")
 
     # Set title, description, creator, and language
-    ElementTree.SubElement(channel, "title").text = comic_info.get("Comic Info", "Comic name")
-    ElementTree.SubElement(channel, "description").text = comic_info.get("RSS Feed", "Description")
-    ElementTree.SubElement(channel, "link").text = comic_url
-    ElementTree.SubElement(channel, "{http://purl.org/dc/elements/1.1/}creator").text = \
-        comic_info.get("Comic Info", "Author")
-    ElementTree.SubElement(channel, "language").text = comic_info.get("RSS Feed", "Language")
-
-
-def add_image_tag(channel, comic_url, comic_info):
-    image_tag = ElementTree.SubElement(channel, "image")
-    ElementTree.SubElement(image_tag, "title").text = comic_info.get("Comic Info", "Comic name")
-    ElementTree.SubElement(image_tag, "link").text = comic_url
-    ElementTree.SubElement(image_tag, "url").text = urljoin(comic_url, comic_info.get("RSS Feed", "Image"))
-    ElementTree.SubElement(image_tag, "width").text = comic_info.get("RSS Feed", "Image width")
-    ElementTree.SubElement(image_tag, "height").text = comic_info.get("RSS Feed", "Image height")
-
-
-def add_item(xml_parent, comic_data, comic_url, comic_info):
-    global cdata_dict
-    post_id = comic_data["page_name"]
-    item = ElementTree.SubElement(xml_parent, "item")
-    ElementTree.SubElement(item, "title").text = comic_data["page_title"]
-    ElementTree.SubElement(item, "{http://purl.org/dc/elements/1.1/}creator").text = \
-        comic_info.get("Comic Info", "Author")
-    post_date = strptime(comic_data["post_date"], comic_info.get("Comic Settings", "Date format"))
-    ElementTree.SubElement(item, "pubDate").text = strftime("%a, %d %b %Y %H:%M:%S +0000", post_date)
+    write_element(f, 2, "title", title)
+    write_element(f, 2, "description", (
+        comic_info.get("RSS Feed", "Description", fallback="") or comic_info.get("Comic Info", "Description")
+    ))
+    write_element(f, 2, "link", comic_url)
+    write_element(f, 2, "dc:creator", comic_info.get("Comic Info", "Author"))
+    write_element(f, 2, "language", comic_info.get("RSS Feed", "Language"))
+
+
+def write_image_tag(f: TextIO, comic_url: str, comic_info: RawConfigParser):
+    f.write(INDENT * 2 + "<image>\n")
+    write_element(f, 3, "title", comic_info.get("Comic Info", "Comic name"))
+    write_element(f, 3, "link", comic_url)
+    write_element(f, 3, "url", urljoin(comic_url, comic_info.get("RSS Feed", "Image")))
+    write_element(f, 3, "width", comic_info.get("RSS Feed", "Image width"))
+    write_element(f, 3, "height", comic_info.get("RSS Feed", "Image height"))
+    f.write(INDENT * 2 + "</image>\n")
+
+
+def write_item(f: TextIO, comic_page: ComicPage, comic_url: str, comic_info: RawConfigParser):
+    post_id = comic_page.page_name
+    f.write(INDENT * 2 + "<item>\n")
+    write_element(f, 3, "title", comic_page.page_title)
+    write_element(f, 3, "dc:creator", comic_info.get("Comic Info", "Author"))
+    write_element(f, 3, "pubDate", comic_page.post_datetime.strftime("%a, %d %b %Y %H:%M:%S +0000"))
     direct_link = urljoin(comic_url, "comic/{}.html".format(post_id))
-    ElementTree.SubElement(item, "link").text = direct_link
-    ElementTree.SubElement(item, "guid", isPermaLink="true").text = direct_link
-    if "storyline" in comic_data:
-        e = ElementTree.SubElement(item, "category")
-        e.attrib["type"] = "storyline"
-        e.text = comic_data["storyline"]
-    if "characters" in comic_data:
-        for character in comic_data["characters"]:
-            e = ElementTree.SubElement(item, "category")
-            e.attrib["type"] = "character"
-            e.text = character
-    if "tags" in comic_data:
-        for tag in comic_data["tags"]:
-            e = ElementTree.SubElement(item, "category")
-            e.attrib["type"] = "tag"
-            e.text = tag
-    comic_image_url = urljoin(comic_url, "your_content/comics/{}/{}".format(post_id, comic_data["filename"]))
-    html = build_rss_post(comic_image_url, comic_data.get("alt_text"), comic_data["post_html"])
-    cdata_dict["post_id_" + post_id] = "<![CDATA[{}]]>".format(html)
-    ElementTree.SubElement(item, "description").text = "{post_id_" + post_id + "}"
+    write_element(f, 3, "link", direct_link)
+    write_element(f, 3, "guid", direct_link, isPermaLink="true")
+    if comic_page.storyline:
+        write_element(f, 3, "category", comic_page.storyline, type="storyline")
+    for character in comic_page.characters:
+        write_element(f, 3, "category", character, type="character")
+    for tag in comic_page.tags:
+        write_element(f, 3, "category", tag, type="tag")
+    comic_image_url = urljoin(comic_url, "your_content/comics/{}/{}".format(post_id, comic_page.filename))
+    html = build_rss_post(comic_image_url, comic_page.alt_text, comic_page.post_html)
+    write_element(f, 3, "description", raw_text=cdata(html))
+    f.write(INDENT * 2 + "</item>\n")
 
 
 def build_rss_post(comic_image_url, alt_text, post_html):
@@ -77,42 +107,100 @@ def build_rss_post(comic_image_url, alt_text, post_html):
     return "<p>{}</p>\n\n<hr>\n\n{}".format(comic_image, post_html)
 
 
-def pretty_xml(element):
-    raw_string = ElementTree.tostring(
-        element, xml_declaration=True, encoding='utf-8', method="xml"
-    ).decode("utf-8")
-    flattened_string = sub(r"\n\s*", "", raw_string)
-    pretty_string = minidom.parseString(flattened_string).toprettyxml(indent="    ")
-    # print(pretty_string)
-    # return bytes(pretty_string.replace("&lt;", "<").replace("&gt;", ">").replace("&quot;", '"').replace(r"\n", "\n"), "utf-8")
-    return pretty_string
-
-
-def build_rss_feed(comic_info: RawConfigParser, comic_data_dicts: List[Dict]):
-    global cdata_dict
-
+def get_item_key(manifest: Dict, comic_page: ComicPage) -> str:
+    # Everything in a feed item comes from the page's info.ini and post text, or from the settings in the global key
+    page_dir = f"your_content/comics/{comic_page.page_name}/"
+    return hash_values(comic_page.page_name, hash_file(manifest, page_dir + "info.ini"),
+                       hash_file(manifest, page_dir + "post.txt"))
+
+
+def write_feed(comic_info: RawConfigParser, comic_url: str, title: str, feed_path: str, comic_pages: List[ComicPage],
+               links: List[Tuple[str, str]], archived: bool, manifest: Dict, global_key: str,
+               load_pages: Callable[[List[ComicPage]], Iterable[ComicPage]]):
+    """
+    Writes a single feed document, if it's changed since the last build.
+    :param archived: If True, the feed is marked as an archived feed, which feed readers can keep instead of checking it
+    again
+    :param load_pages: Loads the post text of the given pages, one page at a time (see with_page_content() in
+    build_site.py). Only called if the feed has to be written.
+    """
+    feed_key = hash_values(global_key, feed_path, title, links, archived,
+                           [get_item_key(manifest, comic_page) for comic_page in comic_pages])
+    if not needs_update(manifest, feed_path, feed_key):
+        return
+    print("Writing {}...".format(feed_path))
+    if os.path.dirname(feed_path):
+        os.makedirs(os.path.dirname(feed_path), exist_ok=True)
+
+    # Write the feed one item at a time, instead of building the whole document in memory first
+    with open_output_file(feed_path) as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        f.write('<rss xmlns:atom="http://www.w3.org/2005/Atom" xmlns:dc="http://purl.org/dc/elements/1.1/" ')
+        if archived:
+            f.write('xmlns:fh="{}" '.format(FEED_HISTORY_NAMESPACE))
+        f.write('version="2.0">\n')
+        f.write(INDENT + "<channel>\n")
+        write_channel_tags(f, comic_url, comic_info, title, feed_path, links)
+        if archived:
+            write_element(f, 2, "fh:archive")
+        write_image_tag(f, comic_url, comic_info)
+        for comic_page in load_pages(comic_pages):
+            write_item(f, comic_page, comic_url, comic_info)
+        f.write(INDENT + "</channel>\n")
+        f.write("</rss>\n")
+
+
+def write_paged_feed(comic_info: RawConfigParser, comic_url: str, title: str, feed_path: str, archive_dir: str,
+                     comic_pages: List[ComicPage], manifest: Dict, global_key: str,
+                     load_pages: Callable[[List[ComicPage]], Iterable[ComicPage]]):
+    """
+    Writes a feed of the latest pages to `feed_path`. If "Archive page size" is set, every full group of that many
+    pages, counted from the first page, also gets its own archived feed in `archive_dir`, and the feeds are linked
+    together as described in RFC 5005. Archived feeds never change once they're full, so feed readers and web hosts
+    don't have to download them again, and `feed_path` stays the same size no matter how many pages there are.
+    """
+    archive_page_size = comic_info.getint("RSS Feed", "Archive page size", fallback=0)
+    item_count = comic_info.getint("RSS Feed", "Number of items", fallback=0)
+    archive_count = len(comic_pages) // archive_page_size if archive_page_size > 0 else 0
+    archive_paths = ["{}{}.xml".format(archive_dir, number) for number in range(1, archive_count + 1)]
+    for i, archive_path in enumerate(archive_paths):
+        links = [("current", feed_path)]
+        if i > 0:
+            links.append(("prev-archive", archive_paths[i - 1]))
+        write_feed(comic_info, comic_url, title, archive_path,
+                   comic_pages[i * archive_page_size:(i + 1) * archive_page_size], links, True, manifest, global_key,
+                   load_pages)
+
+    # Only include the most recent pages, if there's a limit. Every page that isn't in an archived feed yet is always
+    # included, so feed readers that follow the archive links don't miss any.
+    archived_page_count = archive_count * archive_page_size
+    first_item = max(0, len(comic_pages) - item_count) if item_count > 0 else archived_page_count
+    if archive_paths:
+        first_item = min(first_item, archived_page_count)
+    links = [("prev-archive", archive_paths[-1])] if archive_paths else []
+    write_feed(comic_info, comic_url, title, feed_path, comic_pages[first_item:], links, False, manifest, global_key,
+               load_pages)
+
+
+def build_rss_feed(comic_info: RawConfigParser, comic_pages: List[ComicPage], storylines: Dict[str, List[ComicPage]],
+                   manifest: Dict, global_key: str, load_pages: Callable[[List[ComicPage]], Iterable[ComicPage]]):
+    """
+    Writes feed.xml, its archived feeds, and the storyline feeds, if they're turned on.
+    :param global_key: The key for everything that affects every page (see get_global_key() in build_site.py)
+    :param load_pages: Loads the post text of the given pages, one page at a time
+    """
     if not comic_info.getboolean("RSS Feed", "Build RSS feed"):
         return
 
-    register_namespace("atom", "http://www.w3.org/2005/Atom")
-    register_namespace("dc", "http://purl.org/dc/elements/1.1/")
-    root = ElementTree.Element("rss")
-    root.set("version", "2.0")
-    channel = ElementTree.SubElement(root, "channel")
-
     # Build comic URL
     comic_url, _ = get_comic_url(comic_info)
-
-    add_base_tags_to_channel(channel, comic_url, comic_info)
-    add_image_tag(channel, comic_url, comic_info)
-
-    for comic_data in comic_data_dicts:
-        add_item(channel, comic_data, comic_url, comic_info)
-
-    pretty_string = pretty_xml(root)
-
-    # Replace CDATA manually, because XML is stupid and I can't figure out how to insert raw text
-    pretty_string = pretty_string.format(**cdata_dict)
-
-    with open("feed.xml", 'wb') as f:
-        f.write(bytes(pretty_string, "utf-8"))
+    comic_name = comic_info.get("Comic Info", "Comic name")
+
+    write_paged_feed(comic_info, comic_url, comic_name, "feed.xml", "feed/archive/", comic_pages, manifest,
+                     global_key, load_pages)
+    if comic_info.getboolean("RSS Feed", "Storyline feeds", fallback=False):
+        for storyline, storyline_pages in storylines.items():
+            storyline_dir = "feed/storylines/{}/".format(storyline)
+            write_paged_feed(comic_info, comic_url, "{} - {}".format(comic_name, storyline),
+                             storyline_dir + "feed.xml", storyline_dir + "archive/", storyline_pages, manifest,
+                             global_key, load_pages)
@@ -1,29 +1,42 @@
+from time import time
+
+# When this script started loading, so the build can report how long its imports took
+IMPORT_START_TIME = time()
+
 import html
 import os
 import re
 import shutil
-import socket
-from collections import OrderedDict, defaultdict
+from argparse import ArgumentParser
+from collections import OrderedDict
 from configparser import RawConfigParser
 from datetime import datetime
-from glob import glob
 from json import dumps
-from time import strptime, time, strftime
-from typing import Dict, List, Tuple
-
-from PIL import Image
-from jinja2 import Environment, FileSystemLoader, TemplateNotFound
-from markdown2 import Markdown
-from pytz import timezone
+from typing import Dict, Iterable, Iterator, List, Tuple
 
+import compress_output
+import tracing
+from build_manifest import (delete_stale_outputs, hash_file, hash_values, load_manifest, needs_update,
+                            record_output_files, save_deploy_delta, save_manifest)
 from build_rss_feed import build_rss_feed
-from utils import get_comic_url
+from comic_page import ComicPage
+from compress_output import (add_minified_sizes, compress_output_files, set_minify_output, take_minified_sizes,
+                             write_output_file)
+from content_cache import CACHE_DIRECTORY, get_cached, get_page_cached, load_content_cache, save_content_cache
+from content_index import list_files, list_files_recursive, list_subdirectories, scan_content_tree
+from process_images import add_image_info, process_comic_images
+from utils import get_comic_url, get_worker_count, str_to_list
 
 VERSION = "0.2.1"
 
-JINJA_ENVIRONMENT = Environment(
-    loader=FileSystemLoader("src/templates")
-)
+# Jinja, markdown2, and PIL take a while to import, so they're only imported once a stage of the build needs them.
+# Incremental builds often don't need some of them at all. The Jinja environment is created by get_jinja_environment().
+JINJA_ENVIRONMENT = None
+# Compiled templates are saved here, so they don't have to be compiled again on every build
+TEMPLATE_CACHE_DIRECTORY = os.path.join(CACHE_DIRECTORY, "templates")
+USE_TEMPLATE_CACHE = True
+# The build scripts are only imported once per process, so only the first build in it reports how long that took
+IMPORT_TIME_REPORTED = False
 AUTOGENERATE_WARNING = """<!--
 !! DO NOT EDIT THIS FILE !!
 It is auto-generated and any work you do here will be replaced the next time this page is generated.
@@ -31,7 +44,46 @@ If you want to edit any of these files, edit their *.tpl versions in src/templat
 -->
 """
 BASE_DIRECTORY = None
-MARKDOWN = Markdown(extras=["strike"])
+# Values shared by every comic page, set once in each render worker process by init_render_worker()
+RENDER_GLOBAL_VALUES = None
+# Created by get_markdown() the first time a Markdown file is converted
+MARKDOWN = None
+# Markdown files whose contents are added before and after the post text of every page
+SHARED_POST_TEXT_PATHS = ("your_content/before post text.txt", "your_content/after post text.txt")
+
+
+def get_jinja_environment():
+    global JINJA_ENVIRONMENT
+    if JINJA_ENVIRONMENT is None:
+        from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+        bytecode_cache = None
+        if USE_TEMPLATE_CACHE:
+            # Jinja checks each cached template against the template's source, so edited templates are recompiled
+            os.makedirs(TEMPLATE_CACHE_DIRECTORY, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIRECTORY)
+        JINJA_ENVIRONMENT = Environment(
+            loader=FileSystemLoader("src/templates"),
+            bytecode_cache=bytecode_cache
+        )
+    return JINJA_ENVIRONMENT
+
+
+def set_template_cache(enabled: bool):
+    """
+    Turns the compiled template cache on or off. The Jinja environment is created again if this changes it.
+    """
+    global JINJA_ENVIRONMENT, USE_TEMPLATE_CACHE
+    if enabled != USE_TEMPLATE_CACHE:
+        USE_TEMPLATE_CACHE = enabled
+        JINJA_ENVIRONMENT = None
+
+
+def get_markdown():
+    global MARKDOWN
+    if MARKDOWN is None:
+        from markdown2 import Markdown
+        MARKDOWN = Markdown(extras=["strike"])
+    return MARKDOWN
 
 
 def path(rel_path: str):
@@ -40,18 +92,6 @@ def path(rel_path: str):
     return rel_path
 
 
-def str_to_list(s, delimiter=","):
-    """
-    split(), but with extra stripping of white space and leading/trailing delimiters
-    :param s:
-    :param delimiter:
-    :return:
-    """
-    if not s:
-        return []
-    return [item.strip(" ") for item in s.strip(delimiter + " ").split(delimiter)]
-
-
 def get_links_list(comic_info: RawConfigParser):
     link_list = []
     for option in comic_info.options("Links Bar"):
@@ -68,6 +108,7 @@ def get_pages_list(comic_info: RawConfigParser):
 
 def delete_output_file_space(comic_info: RawConfigParser = None):
     shutil.rmtree("comic", ignore_errors=True)
+    shutil.rmtree("feed", ignore_errors=True)
     if os.path.isfile("feed.xml"):
         os.remove("feed.xml")
     if comic_info is None:
@@ -84,9 +125,13 @@ def delete_output_file_space(comic_info: RawConfigParser = None):
                 shutil.rmtree(page["template_name"])
 
 
-def setup_output_file_space(comic_info: RawConfigParser):
-    # Clean workspace, i.e. delete old files
-    delete_output_file_space(comic_info)
+def setup_output_file_space(comic_info: RawConfigParser, manifest: Dict, incremental: bool = False):
+    # Old files are kept around, so files that come out the same aren't rewritten, and stale files are deleted at the
+    # end of the build instead. Without a record of what the last build wrote, the only way to get rid of old files is
+    # to delete them all first.
+    if not incremental and not manifest["previous"]["outputs"]:
+        # Clean workspace, i.e. delete old files
+        delete_output_file_space(comic_info)
     # Create directories if needed
     os.makedirs("comic", exist_ok=True)
 
@@ -108,12 +153,19 @@ def read_info(filepath, to_dict=False):
     return info
 
 
-def get_page_info_list(comic_info: RawConfigParser) -> Tuple[List[Dict], int]:
+def get_page_info_list(comic_info: RawConfigParser, content_cache: Dict,
+                       content_index: Dict) -> Tuple[List[Dict], int, Dict[str, datetime]]:
+    """
+    Reads the info.ini for every comic page that's been posted, sorted by post date.
+    :return: The page info list, the number of scheduled pages, and each page's post date, parsed from its info.ini
+    """
+    from pytz import timezone
     date_format = comic_info.get("Comic Settings", "Date format")
     tzinfo = timezone(comic_info.get("Comic Settings", "Timezone"))
     local_time = datetime.now(tz=tzinfo)
     print(f"Local time is {local_time}")
     page_info_list = []
+    post_dates = {}
     scheduled_post_count = 0
     # Check if we're running on GitHub, and if scheduled posts should be deleted
     running_on_github = "GITHUB_REPOSITORY" in os.environ
@@ -123,36 +175,93 @@ def get_page_info_list(comic_info: RawConfigParser) -> Tuple[List[Dict], int]:
         delete_scheduled_posts_val == "always" or
         (delete_scheduled_posts_val == "github" and running_on_github)
     )
-    for page_path in glob("your_content/comics/*/"):
-        page_info = read_info(f"{page_path}info.ini", to_dict=True)
-        post_date = tzinfo.localize(datetime.strptime(page_info["Post date"], date_format))
-        if post_date > local_time:
+    for page_name in list_subdirectories(content_index, "your_content/comics"):
+        page_path = f"your_content/comics/{page_name}/"
+        info_path = f"{page_path}info.ini"
+        if "info.ini" not in list_files(content_index, page_path):
+            # e.g. a page that's still being imported, or one whose import failed
+            print(f"Skipping {page_path}, because it has no info.ini")
+            continue
+        # Copy the cached info, because it gets modified below
+        page_info = dict(get_cached(content_cache, "info:" + info_path, [info_path],
+                                    lambda: read_info(info_path, to_dict=True)))
+        post_date = datetime.strptime(page_info["Post date"], date_format)
+        if tzinfo.localize(post_date) > local_time:
             scheduled_post_count += 1
             # Post date is in the future, so delete the folder with the resources
             if delete_scheduled_posts:
                 print(f"Deleting {page_path}")
                 shutil.rmtree(page_path)
         else:
-            page_info["page_name"] = os.path.basename(os.path.normpath(page_path))
+            page_info["page_name"] = page_name
             page_info["Storyline"] = page_info.get("Storyline", "")
             page_info["Characters"] = str_to_list(page_info.get("Characters", ""))
             page_info["Tags"] = str_to_list(page_info.get("Tags", ""))
             page_info_list.append(page_info)
+            post_dates[page_name] = post_date
 
     page_info_list = sorted(
         page_info_list,
-        key=lambda x: (strptime(x["Post date"], date_format), x["page_name"])
+        key=lambda x: (post_dates[x["page_name"]], x["page_name"])
     )
-    return page_info_list, scheduled_post_count
+    return page_info_list, scheduled_post_count, post_dates
 
 
-def save_page_info_json_file(page_info_list: List, scheduled_post_count: int):
+def save_page_info_json_file(page_info_list: List, scheduled_post_count: int, manifest: Dict):
     d = {
         "page_info_list": page_info_list,
         "scheduled_post_count": scheduled_post_count
     }
-    with open("comic/page_info_list.json", "w") as f:
-        f.write(dumps(d))
+    json_string = dumps(d)
+    if needs_update(manifest, "comic/page_info_list.json", hash_values(json_string)):
+        write_output_file("comic/page_info_list.json", json_string.encode("utf-8"))
+
+
+def get_lookup_bucket(page_name: str, bucket_count: int) -> int:
+    """
+    Hashes a page name into a lookup bucket. This must match get_lookup_bucket() in src/js/infinite_scroll.js, which
+    hashes the UTF-16 code units of the name the same way.
+    """
+    h = 0
+    encoded = page_name.encode("utf-16-le")
+    for low, high in zip(encoded[::2], encoded[1::2]):
+        h = (h * 31 + (high << 8 | low)) & 0xFFFFFFFF
+    return h % bucket_count
+
+
+def save_page_info_chunks(page_info_list: List, scheduled_post_count: int, chunk_size: int, manifest: Dict):
+    """
+    Splits the page info list into small files, so the infinite scroll page only has to download the pages around the
+    one being read, instead of the info for every page in the comic:
+        comic/page_info/index.json: Page count, chunk size, and number of lookup buckets
+        comic/page_info/chunk_N.json: The page info for pages N * chunk_size up to (N + 1) * chunk_size
+        comic/page_info/lookup_N.json: Page name -> page number, for every page name that hashes into bucket N
+    Only files whose contents changed are rewritten.
+    """
+    chunk_count = (len(page_info_list) + chunk_size - 1) // chunk_size
+    # Roughly one page number per page in each lookup bucket, same as the chunks
+    bucket_count = max(1, chunk_count)
+    files = {
+        "comic/page_info/index.json": {
+            "page_count": len(page_info_list),
+            "chunk_size": chunk_size,
+            "chunk_count": chunk_count,
+            "lookup_bucket_count": bucket_count,
+            "scheduled_post_count": scheduled_post_count,
+        }
+    }
+    for i in range(chunk_count):
+        files[f"comic/page_info/chunk_{i}.json"] = page_info_list[i * chunk_size:(i + 1) * chunk_size]
+    buckets = [{} for _ in range(bucket_count)]
+    for i, page_info in enumerate(page_info_list):
+        buckets[get_lookup_bucket(page_info["page_name"], bucket_count)][page_info["page_name"]] = i
+    for i, bucket in enumerate(buckets):
+        files[f"comic/page_info/lookup_{i}.json"] = bucket
+    os.makedirs("comic/page_info", exist_ok=True)
+    for json_path, data in files.items():
+        json_string = dumps(data)
+        if needs_update(manifest, json_path, hash_values(json_string)):
+            write_output_file(json_path, json_string.encode("utf-8"))
 
 
 def get_ids(comic_list: List[Dict], index):
@@ -167,248 +276,690 @@ def get_ids(comic_list: List[Dict], index):
     }
 
 
-def get_transcripts(comic_info: RawConfigParser, page_name: str) -> OrderedDict:
-    if not comic_info.getboolean("Transcripts", "Enable transcripts"):
-        return OrderedDict()
-    transcripts = OrderedDict()
-    transcripts_dir = "your_content/comics"
+def get_transcripts_dir(comic_info: RawConfigParser) -> str:
     if comic_info.has_option("Transcripts", "Transcripts folder"):
         directory = comic_info.get("Transcripts", "Transcripts folder")
         if directory:
-            transcripts_dir = directory
-    for path in glob(os.path.join(transcripts_dir, page_name, "*.txt")):
-        if path.endswith("post.txt"):
-            continue
-        language = os.path.splitext(os.path.basename(path))[0]
+            return directory
+    return "your_content/comics"
+
+
+def get_content_roots(comic_info: RawConfigParser) -> List[str]:
+    """
+    Returns the folders that the build reads content from, and that are scanned once at the start of each build
+    """
+    return ["your_content", get_transcripts_dir(comic_info), "src/templates"]
+
+
+def get_transcript_language(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def get_transcript_paths(comic_info: RawConfigParser, page_name: str, content_index: Dict) -> List[str]:
+    """
+    Returns the paths of a page's transcripts, with the English one first if there is one
+    """
+    if not comic_info.getboolean("Transcripts", "Enable transcripts"):
+        return []
+    page_transcripts_dir = os.path.join(get_transcripts_dir(comic_info), page_name)
+    transcript_paths = [
+        os.path.join(page_transcripts_dir, filename)
+        for filename in list_files(content_index, page_transcripts_dir)
+        if filename.endswith(".txt") and filename != "post.txt"
+    ]
+    return sorted(transcript_paths, key=lambda path: get_transcript_language(path) != "English")
+
+
+def read_transcript(path: str) -> str:
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8").replace("\n", "<br>\n")
+
+
+def read_transcripts(transcript_paths: List[str]) -> List[Tuple[str, str]]:
+    # Returned as a list of pairs, so the order survives being saved in the content cache
+    return [(get_transcript_language(path), read_transcript(path)) for path in transcript_paths]
+
+
+def get_transcripts(comic_info: RawConfigParser, page_name: str, content_cache: Dict,
+                    content_index: Dict) -> OrderedDict:
+    transcript_paths = get_transcript_paths(comic_info, page_name, content_index)
+    if not transcript_paths:
+        return OrderedDict()
+    return OrderedDict(get_page_cached(content_cache, page_name, "transcripts", transcript_paths,
+                                       lambda: read_transcripts(transcript_paths)))
+
+
+def get_transcript_fragment_path(page_name: str, language: str) -> str:
+    return f"comic/{page_name}/transcripts/{language}.html"
+
+
+def write_transcript_fragments(comic_info: RawConfigParser, comic_pages: List[ComicPage], manifest: Dict):
+    """
+    Writes every transcript except the first (default) one for each page to its own small HTML file, which
+    transcript.js loads when that language is selected. Those transcripts aren't inlined into the comic pages.
+    Each transcript is only read if its fragment has to be written.
+    """
+    for comic_page in comic_pages:
+        transcript_paths = get_transcript_paths(comic_info, comic_page.page_name, manifest["content_index"])
+        for path in transcript_paths[1:]:
+            fragment_path = get_transcript_fragment_path(comic_page.page_name, get_transcript_language(path))
+            if needs_update(manifest, fragment_path, hash_values(VERSION, hash_file(manifest, path))):
+                os.makedirs(os.path.dirname(fragment_path), exist_ok=True)
+                write_output_file(fragment_path, read_transcript(path).encode("utf-8"))
+
+
+def render_markdown_file(path: str) -> str:
+    """
+    Renders a Markdown file to HTML. Returns an empty string if the file doesn't exist or is blank.
+    """
+    try:
         with open(path, "rb") as f:
-            transcripts[language] = f.read().decode("utf-8").replace("\n", "<br>\n")
-    if "English" in transcripts:
-        transcripts.move_to_end("English", last=False)
-    return transcripts
+            text = f.read().decode("utf-8")
+    except FileNotFoundError:
+        return ""
+    if not text.strip():
+        return ""
+    tracing.count("Markdown files converted")
+    with tracing.span("Convert Markdown", path=path):
+        return get_markdown().convert(text)
 
 
-def create_comic_data(comic_info: RawConfigParser, page_info: dict,
-                      first_id: str, previous_id: str, current_id: str, next_id: str, last_id: str):
+def get_shared_post_html(content_cache: Dict) -> Tuple[str, str]:
+    """
+    Renders the text that goes before and after every post once per build, instead of once for every page
+    """
+    before_html, after_html = (
+        get_cached(content_cache, "post:" + path, [path], lambda: render_markdown_file(path))
+        for path in SHARED_POST_TEXT_PATHS
+    )
+    return before_html, after_html
+
+
+def compose_post_html(before_html: str, page_html: str, after_html: str) -> str:
+    # Rendering each block separately and joining them gives the same HTML as rendering the joined Markdown, as long as
+    # the blocks don't refer to each other (e.g. reference-style links defined in a different block)
+    parts = [part for part in (before_html, page_html, after_html) if part]
+    return "\n".join(parts) if parts else get_markdown().convert("")
+
+
+def create_comic_page(comic_info: RawConfigParser, page_info: dict, post_date: datetime, first_id: str,
+                      previous_id: str, current_id: str, next_id: str, last_id: str) -> ComicPage:
+    """
+    Creates a page with everything except its post text and transcripts, which are only loaded while the page is being
+    written (see with_page_content())
+    """
     print("Building page {}...".format(page_info["page_name"]))
     page_dir = f"your_content/comics/{page_info['page_name']}/"
-    archive_post_date = strftime(comic_info.get("Archive", "Date format"),
-                                 strptime(page_info["Post date"], comic_info.get("Comic Settings", "Date format")))
-    post_html = []
-    post_text_paths = [
-        "your_content/before post text.txt",
-        page_dir + "post.txt",
-        "your_content/after post text.txt"
-    ]
-    for path in post_text_paths:
-        if os.path.exists(path):
-            with open(path, "rb") as f:
-                post_html.append(f.read().decode("utf-8"))
-    post_html = MARKDOWN.convert("\n\n".join(post_html))
-    return {
-        "page_name": page_info["page_name"],
-        "filename": page_info["Filename"],
-        "comic_path": page_dir + page_info["Filename"],
-        "thumbnail_path": page_dir + os.path.splitext(page_info["Filename"])[0] + "_thumbnail.jpg",
-        "alt_text": html.escape(page_info["Alt text"]),
-        "first_id": first_id,
-        "previous_id": previous_id,
-        "current_id": current_id,
-        "next_id": next_id,
-        "last_id": last_id,
-        "page_title": page_info["Title"],
-        "post_date": page_info["Post date"],
-        "archive_post_date": archive_post_date,
-        "storyline": None if "Storyline" not in page_info else page_info["Storyline"],
-        "characters": page_info["Characters"],
-        "tags": page_info["Tags"],
-        "post_html": post_html,
-        "transcripts": get_transcripts(comic_info, page_info["page_name"])
-    }
+    archive_post_date = post_date.strftime(comic_info.get("Archive", "Date format"))
+    return ComicPage(
+        page_name=page_info["page_name"],
+        filename=page_info["Filename"],
+        comic_path=page_dir + page_info["Filename"],
+        thumbnail_path=page_info.get("thumbnail_path",
+                                     page_dir + os.path.splitext(page_info["Filename"])[0] + "_thumbnail.jpg"),
+        alt_text=html.escape(page_info["Alt text"]),
+        first_id=first_id,
+        previous_id=previous_id,
+        current_id=current_id,
+        next_id=next_id,
+        last_id=last_id,
+        page_title=page_info["Title"],
+        post_date=page_info["Post date"],
+        post_datetime=post_date,
+        archive_post_date=archive_post_date,
+        storyline=None if "Storyline" not in page_info else page_info["Storyline"],
+        characters=page_info["Characters"],
+        tags=page_info["Tags"],
+        post_html=None,
+        transcripts=None,
+        image_width=page_info.get("image_width"),
+        image_height=page_info.get("image_height"),
+        image_variants=page_info.get("image_variants", []),
+        thumbnail_width=page_info.get("thumbnail_width"),
+        storyline_archive_path="archive/",
+        next_page_image=None,
+    )
 
 
-def build_comic_data_dicts(comic_info: RawConfigParser, page_info_list: List[Dict]) -> List[Dict]:
-    comic_data_dicts = []
+def build_comic_pages(comic_info: RawConfigParser, page_info_list: List[Dict],
+                      post_dates: Dict[str, datetime]) -> List[ComicPage]:
+    comic_pages = []
     for i, page_info in enumerate(page_info_list):
-        comic_dict = create_comic_data(comic_info, page_info, **get_ids(page_info_list, i))
-        comic_data_dicts.append(comic_dict)
-    return comic_data_dicts
-
-
-def resize(im, size):
-    if "," in size:
-        # Convert a string of the form "100, 36" into a 2-tuple of ints (100, 36)
-        x, y = size.strip().split(",")
-        new_size = (int(x.strip()), int(y.strip()))
-    elif size.endswith("%"):
-        # Convert a percentage (50%) into a new size (50, 18)
-        size = float(size.strip().strip("%"))
-        size = size / 100
-        x, y = im.size
-        new_size = (int(x * size), int(y * size))
-    else:
-        raise ValueError("Unknown resize value: {!r}".format(size))
-    return im.resize(new_size)
+        with tracing.span("Build page data", "page", page=page_info["page_name"]):
+            comic_page = create_comic_page(comic_info, page_info, post_dates[page_info["page_name"]],
+                                           **get_ids(page_info_list, i))
+        comic_pages.append(comic_page)
+    return comic_pages
 
 
-def save_image(im, path):
-    try:
-        im.save(path)
-    except OSError as e:
-        if str(e) == "cannot write mode RGBA as JPEG":
-            # Get rid of transparency
-            bg = Image.new("RGB", im.size, "WHITE")
-            bg.paste(im, (0, 0), im)
-            bg.save(path)
-        else:
-            raise
-
-
-def process_comic_image(comic_info, comic_page_path, create_thumbnails, create_low_quality):
-    section = "Image Reprocessing"
-    comic_page_dir = os.path.dirname(comic_page_path)
-    comic_page_name, comic_page_ext = os.path.splitext(os.path.basename(comic_page_path))
-    with open(comic_page_path, "rb") as f:
-        im = Image.open(f)
-        if create_thumbnails:
-            thumbnail_path = os.path.join(comic_page_dir, comic_page_name + "_thumbnail.jpg")
-            if comic_info.getboolean(section, "Overwrite existing images") or not os.path.isfile(thumbnail_path):
-                print(f"Creating thumbnail for {comic_page_name}")
-                thumb_im = resize(im, comic_info.get(section, "Thumbnail size"))
-                save_image(thumb_im, thumbnail_path)
-        if create_low_quality:
-            file_type = comic_info.get(section, "Low-quality file type")
-            low_quality_path = os.path.join(comic_page_dir, comic_page_name + "_low_quality." + file_type.lower())
-            if comic_info.getboolean(section, "Overwrite existing images") or not os.path.isfile(low_quality_path):
-                print(f"Creating low quality version of {comic_page_name}")
-                save_image(im, low_quality_path)
-
-
-def process_comic_images(comic_info, comic_data_dicts: List[Dict]):
-    section = "Image Reprocessing"
-    create_thumbnails = comic_info.getboolean(section, "Create thumbnails")
-    create_low_quality = comic_info.getboolean(section, "Create low-quality versions of images")
-    if create_thumbnails or create_low_quality:
-        for comic_data in comic_data_dicts:
-            process_comic_image(comic_info, comic_data["comic_path"], create_thumbnails, create_low_quality)
-
-
-def get_storylines(comic_data_dicts: List[Dict]) -> List[Dict[str, List]]:
+def load_page_content(comic_info: RawConfigParser, comic_page: ComicPage, content_cache: Dict, content_index: Dict,
+                      shared_post_html: Tuple[str, str]):
+    """
+    Loads a page's post HTML and its first transcript. The other transcripts are left as None, because transcript.js
+    loads them from their own files.
+    """
+    post_path = f"your_content/comics/{comic_page.page_name}/post.txt"
+    page_post_html = get_page_cached(content_cache, comic_page.page_name, "post", [post_path],
+                                     lambda: render_markdown_file(post_path))
+    comic_page.post_html = compose_post_html(shared_post_html[0], page_post_html, shared_post_html[1])
+    transcripts = get_transcripts(comic_info, comic_page.page_name, content_cache, content_index)
+    for language in list(transcripts)[1:]:
+        transcripts[language] = None
+    comic_page.transcripts = transcripts
+
+
+def unload_page_content(comic_page: ComicPage):
+    comic_page.post_html = None
+    comic_page.transcripts = None
+
+
+def with_page_content(comic_info: RawConfigParser, comic_pages: Iterable[ComicPage], content_cache: Dict,
+                      content_index: Dict) -> Iterator[ComicPage]:
+    """
+    Yields each page with its post text and transcripts loaded, and drops them again once the next page is asked for.
+    That way, only one page's content is in memory at a time, no matter how many pages there are.
+    """
+    shared_post_html = get_shared_post_html(content_cache)
+    for comic_page in comic_pages:
+        with tracing.span("Load page content", "page", page=comic_page.page_name):
+            load_page_content(comic_info, comic_page, content_cache, content_index, shared_post_html)
+        try:
+            yield comic_page
+        finally:
+            unload_page_content(comic_page)
+
+
+def get_storylines(comic_pages: List[ComicPage]) -> Dict[str, List[ComicPage]]:
     # Start with an OrderedDict, so we can easily drop the pages we encounter in the proper buckets, while keeping
-    # their proper order
+    # their proper order. Pages are shared, not copied, since they never have the global values merged into them.
     storylines_dict = OrderedDict()
-    for comic_data in comic_data_dicts:
-        storyline = comic_data["storyline"]
+    for comic_page in comic_pages:
+        storyline = comic_page.storyline
         if storyline:
             if storyline not in storylines_dict.keys():
                 storylines_dict[storyline] = []
-            storylines_dict[storyline].append(comic_data.copy())
+            storylines_dict[storyline].append(comic_page)
     return storylines_dict
 
 
-def write_html_files(comic_info: RawConfigParser, comic_data_dicts: List[Dict], global_values: Dict):
+def get_global_key(manifest: Dict, comic_url: str) -> str:
+    """
+    Builds a key out of everything that affects every generated page, i.e. the comic settings, the shared post text,
+    and the templates. If any of these change, every page gets rebuilt.
+    """
+    input_paths = ["your_content/comic_info.ini"]
+    input_paths.extend(SHARED_POST_TEXT_PATHS)
+    input_paths.extend(list_files_recursive(manifest["content_index"], "src/templates"))
+    return hash_values(VERSION, comic_url, [(p, hash_file(manifest, p)) for p in input_paths])
+
+
+def get_comic_page_key(comic_info: RawConfigParser, manifest: Dict, global_key: str, comic_page: ComicPage) -> str:
+    page_dir = f"your_content/comics/{comic_page.page_name}/"
+    input_paths = [page_dir + "info.ini", page_dir + "post.txt", comic_page.comic_path]
+    input_paths.extend(get_transcript_paths(comic_info, comic_page.page_name, manifest["content_index"]))
+    # comic.tpl only ever compares last_id against the current page, so don't depend on the value of last_id itself.
+    # Otherwise, every page would get rebuilt whenever a new page is posted.
+    ids = {k: getattr(comic_page, k) for k in ("first_id", "previous_id", "current_id", "next_id")}
+    ids["is_last_page"] = comic_page.current_id == comic_page.last_id
+    return hash_values(global_key, [(p, hash_file(manifest, p)) for p in input_paths], ids,
+                       comic_page.storyline_archive_path, comic_page.next_page_image)
+
+
+def get_comic_page_html_path(comic_page: ComicPage) -> str:
+    return f"comic/{comic_page.page_name}/index.html"
+
+
+def write_html_files(comic_info: RawConfigParser, comic_pages: List[ComicPage], global_values: Dict,
+                     manifest: Dict, global_key: str, content_cache: Dict) -> Dict[str, Tuple[int, float]]:
     # Write individual comic pages
-    print("Writing {} comic pages...".format(len(comic_data_dicts)))
-    for comic_data_dict in comic_data_dicts:
-        html_path = f"comic/{comic_data_dict['page_name']}/index.html"
-        comic_data_dict.update(global_values)
-        write_to_template("comic.tpl", html_path, comic_data_dict)
-    write_other_pages(comic_info, comic_data_dicts)
-
-
-def write_other_pages(comic_info: RawConfigParser, comic_data_dicts: List[Dict]):
-    last_comic_page = comic_data_dicts[-1]
-    pages_list = get_pages_list(comic_info)
-    for page in pages_list:
-        if page["template_name"] == "tagged":
-            write_tagged_pages(comic_data_dicts)
-            continue
-        template_name = page["template_name"] + ".tpl"
-        if page["template_name"].lower() in ("index", "404"):
-            html_path = f"{page['template_name']}.html"
+    print("Writing {} comic pages...".format(len(comic_pages)))
+    skipped_count = 0
+    pages_to_write = []
+    for comic_page in comic_pages:
+        html_path = get_comic_page_html_path(comic_page)
+        page_key = get_comic_page_key(comic_info, manifest, global_key, comic_page)
+        if needs_update(manifest, html_path, page_key):
+            pages_to_write.append(comic_page)
         else:
-            html_path = os.path.join(page['template_name'], "index.html")
-        data_dict = {}
-        data_dict.update(last_comic_page)
-        if page["title"]:
-            data_dict["page_title"] = page["title"]
+            skipped_count += 1
+    if skipped_count:
+        print("Skipped {} unchanged comic pages".format(skipped_count))
+    # Each page's post text and transcripts are only loaded right before it's rendered
+    loaded_pages = with_page_content(comic_info, pages_to_write, content_cache, manifest["content_index"])
+    workers = get_worker_count(comic_info, "Render workers")
+    worker_times = {}
+    if workers > 1 and len(pages_to_write) > 1:
+        worker_times = write_comic_pages_in_parallel(loaded_pages, len(pages_to_write), global_values, workers)
+    else:
+        for comic_page in loaded_pages:
+            with tracing.span("Render comic page", "page", page=comic_page.page_name):
+                write_to_template("comic.tpl", get_comic_page_html_path(comic_page),
+                                  comic_page.to_template_values(), global_values)
+    write_other_pages(comic_info, comic_pages, global_values, manifest, global_key, content_cache)
+    return worker_times
+
+
+def init_render_worker(global_values: Dict, trace: bool = False, use_template_cache: bool = True,
+                       minify_output: bool = False):
+    global RENDER_GLOBAL_VALUES
+    RENDER_GLOBAL_VALUES = global_values
+    tracing.init_worker(trace)
+    set_template_cache(use_template_cache)
+    set_minify_output(minify_output)
+    # Compile the templates once per worker, instead of once per page
+    get_jinja_environment().get_template("comic.tpl")
+
+
+def render_comic_pages(pages: List[Tuple[str, Dict]]) -> Tuple[int, int, float, Dict, Dict]:
+    """
+    Renders a chunk of comic pages in a worker process.
+    :param pages: The HTML path and template values of each page
+    :return: The worker's process ID, how many pages it rendered and how long that took, its trace events, and the
+    sizes of the pages it minified
+    """
+    start_time = time()
+    for html_path, data_dict in pages:
+        with tracing.span("Render comic page", "page", page=data_dict["page_name"]):
+            write_to_template("comic.tpl", html_path, data_dict, RENDER_GLOBAL_VALUES)
+    return os.getpid(), len(pages), time() - start_time, tracing.take_worker_trace(), take_minified_sizes()
+
+
+def write_comic_pages_in_parallel(comic_pages: Iterator[ComicPage], page_count: int, global_values: Dict,
+                                  workers: int) -> Dict[str, Tuple[int, float]]:
+    """
+    Renders comic pages in a pool of worker processes. The global values are sent to each worker once, when it starts,
+    instead of being sent along with every page. Pages are sent in chunks, and only a few chunks are waiting to be
+    rendered at any time, so the pages' content doesn't all pile up in memory when the workers can't keep up.
+    :param comic_pages: The pages to render, which are only read from as the workers need more pages
+    :return: A dict of "Render worker N" to the number of pages that worker rendered and how long it spent doing so
+    """
+    # Only imported when a pool is used, because it's slow to import
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    print("Rendering {} comic pages with {} workers...".format(page_count, workers))
+    chunk_size = min(50, max(1, page_count // (workers * 4)))
+    max_pending = workers * 2
+    times_by_pid = OrderedDict()
+
+    def record(finished):
+        for future in finished:
+            pid, count, seconds, worker_trace, minified_sizes = future.result()
+            tracing.add_worker_trace(worker_trace)
+            add_minified_sizes(minified_sizes)
+            total_count, total_seconds = times_by_pid.get(pid, (0, 0.0))
+            times_by_pid[pid] = (total_count + count, total_seconds + seconds)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_render_worker,
+                             initargs=(global_values, tracing.is_enabled(), USE_TEMPLATE_CACHE,
+                                       compress_output.MINIFY_OUTPUT)) as pool:
+        pending = set()
+        chunk = []
+        for comic_page in comic_pages:
+            # The template values keep the page's content alive until the chunk has been sent to a worker, even
+            # though the page itself has already moved on
+            chunk.append((get_comic_page_html_path(comic_page), comic_page.to_template_values()))
+            if len(chunk) < chunk_size:
+                continue
+            if len(pending) >= max_pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                record(finished)
+            pending.add(pool.submit(render_comic_pages, chunk))
+            chunk = []
+        if chunk:
+            pending.add(pool.submit(render_comic_pages, chunk))
+        record(wait(pending)[0])
+    return {
+        "Render worker {}".format(i): times
+        for i, times in enumerate(times_by_pid.values(), start=1)
+    }
+
+
+def paginate(items: List, page_size: int) -> List[List]:
+    """
+    Splits a list into pages of `page_size` items each. A page size of 0 or less puts everything on one page.
+    """
+    if page_size <= 0 or not items:
+        return [items]
+    return [items[i:i + page_size] for i in range(0, len(items), page_size)]
+
+
+def get_pagination(base_path: str, page_number: int, page_count: int) -> Dict:
+    """
+    Builds the pagination info passed to paginated templates. The first page goes in `base_path`, and the rest go in
+    `base_path`/page/N/.
+    """
+    page_paths = [base_path] + [f"{base_path}page/{n}/" for n in range(2, page_count + 1)]
+    return {
+        "page_number": page_number,
+        "page_count": page_count,
+        "page_paths": page_paths,
+    }
+
+
+def get_archive_pages(storylines: Dict[str, List], page_size: int) -> List[Dict[str, List]]:
+    """
+    Splits the storylines into archive pages of `page_size` comic pages each. Storylines that span more than one archive
+    page are split between them.
+    """
+    entries = [(name, page) for name, pages in storylines.items() for page in pages]
+    archive_pages = []
+    for chunk in paginate(entries, page_size):
+        page_storylines = OrderedDict()
+        for name, page in chunk:
+            page_storylines.setdefault(name, []).append(page)
+        archive_pages.append(page_storylines)
+    return archive_pages
+
+
+def add_storyline_archive_paths(comic_pages: List[ComicPage], storylines: Dict[str, List[ComicPage]],
+                                page_size: int):
+    """
+    Adds the path of the archive page each page's storyline starts on, so comic pages can link to it
+    """
+    archive_pages = get_archive_pages(storylines, page_size)
+    archive_paths = get_pagination("archive/", 1, len(archive_pages))["page_paths"]
+    storyline_archive_paths = {}
+    for archive_path, page_storylines in zip(archive_paths, archive_pages):
+        for name in page_storylines:
+            storyline_archive_paths.setdefault(name, archive_path)
+    for comic_page in comic_pages:
+        comic_page.storyline_archive_path = storyline_archive_paths.get(comic_page.storyline, "archive/")
+
+
+def get_image_sources(comic_page: ComicPage) -> Dict[str, str]:
+    """
+    Returns the src, and the srcset and sizes if there are responsive versions, that comic.tpl gives a page's image
+    """
+    src = path("/" + comic_page.comic_path)
+    sources = {"src": src}
+    if comic_page.image_variants:
+        width = comic_page.image_width
+        srcset = [f"{path('/' + variant['path'])} {variant['width']}w" for variant in comic_page.image_variants]
+        srcset.append(f"{src} {width}w")
+        sources["srcset"] = ", ".join(srcset)
+        sources["sizes"] = f"(max-width: {width}px) 100vw, {width}px"
+    return sources
+
+
+def add_next_page_images(comic_pages: List[ComicPage]):
+    """
+    Adds the sources of the next page's image to each page, so comic pages can prefetch it
+    """
+    for comic_page, next_page in zip(comic_pages, comic_pages[1:]):
+        comic_page.next_page_image = get_image_sources(next_page)
+
+
+def write_other_pages(comic_info: RawConfigParser, comic_pages: List[ComicPage], global_values: Dict, manifest: Dict,
+                      global_key: str, content_cache: Dict):
+    last_comic_page = comic_pages[-1]
+    # The other pages show the latest page, so its post text and transcripts are loaded while they're written
+    load_page_content(comic_info, last_comic_page, content_cache, manifest["content_index"],
+                      get_shared_post_html(content_cache))
+    try:
+        # The other pages can depend on any of the comic pages (e.g. the archive page), so rebuild them if anything
+        # changed
+        all_pages_key = hash_values(
+            global_key, [manifest["outputs"].get(get_comic_page_html_path(p)) for p in comic_pages]
+        )
+        pages_list = get_pages_list(comic_info)
+        for page in pages_list:
+            if page["template_name"] == "tagged":
+                write_tagged_pages(comic_info, comic_pages, global_values, manifest, global_key)
+                continue
+            if page["template_name"] == "archive":
+                write_archive_pages(comic_info, last_comic_page, global_values, page["title"], manifest,
+                                    all_pages_key)
+                continue
+            template_name = page["template_name"] + ".tpl"
+            if page["template_name"].lower() in ("index", "404"):
+                html_path = f"{page['template_name']}.html"
+            else:
+                html_path = os.path.join(page['template_name'], "index.html")
+            if not needs_update(manifest, html_path, all_pages_key):
+                continue
+            data_dict = last_comic_page.to_template_values()
+            if page["title"]:
+                data_dict["page_title"] = page["title"]
+            print("Writing {}...".format(html_path))
+            write_to_template(template_name, html_path, data_dict, global_values)
+    finally:
+        unload_page_content(last_comic_page)
+
+
+def write_archive_pages(comic_info: RawConfigParser, last_comic_page: ComicPage, global_values: Dict, title: str,
+                        manifest: Dict, all_pages_key: str):
+    page_size = comic_info.getint("Archive", "Archive page size", fallback=0)
+    archive_pages = get_archive_pages(global_values["storylines"], page_size)
+    for page_number, page_storylines in enumerate(archive_pages, start=1):
+        pagination = get_pagination("archive/", page_number, len(archive_pages))
+        html_path = pagination["page_paths"][page_number - 1] + "index.html"
+        if not needs_update(manifest, html_path, hash_values(all_pages_key, page_number)):
+            continue
+        data_dict = last_comic_page.to_template_values()
+        data_dict["storylines"] = page_storylines
+        data_dict["pagination"] = pagination
+        if title:
+            data_dict["page_title"] = title
         print("Writing {}...".format(html_path))
-        write_to_template(template_name, html_path, data_dict)
-
-
-def write_tagged_pages(comic_data_dicts: List[Dict]):
-    last_comic_page = comic_data_dicts[-1]
-    tags = defaultdict(list)
-    for page in comic_data_dicts:
-        for character in page["characters"]:
-            tags[character].append(page)
-        for tag in page["tags"]:
-            tags[tag].append(page)
-    for tag, pages in tags.items():
-        print("Writing tagged page for {}...".format(tag))
-        data_dict = {
-            "tag": tag,
-            "tagged_pages": pages
-        }
-        data_dict.update(last_comic_page)
-        write_to_template("tagged.tpl", f"tagged/{tag}/index.html", data_dict)
+        write_to_template("archive.tpl", html_path, data_dict, global_values)
 
 
-def write_to_template(template_path, html_path, data_dict=None):
+def get_tag_index(comic_pages: List[ComicPage]) -> Dict[str, List[ComicPage]]:
+    """
+    Builds a dict of every character and tag to the pages with that character or tag, in order. The pages aren't
+    copied, so this is cheap to build once per build.
+    """
+    tags = OrderedDict()
+    for page in comic_pages:
+        for tag in page.characters + page.tags:
+            tags.setdefault(tag, []).append(page)
+    return tags
+
+
+def write_tagged_pages(comic_info: RawConfigParser, comic_pages: List[ComicPage], global_values: Dict, manifest: Dict,
+                       global_key: str):
+    last_comic_page = comic_pages[-1]
+    last_comic_page_key = manifest["outputs"].get(f"comic/{last_comic_page.page_name}/index.html")
+    page_size = comic_info.getint("Archive", "Tagged page size", fallback=0)
+    write_json = comic_info.getboolean("Archive", "Tagged page JSON", fallback=False)
+    for tag, pages in get_tag_index(comic_pages).items():
+        if write_json:
+            # A compact list of every page with this tag, for any scripts that want to navigate between them
+            json_path = f"tagged/{tag}/pages.json"
+            json_string = dumps({
+                "tag": tag,
+                "pages": [[p.page_name, p.page_title, p.post_date] for p in pages]
+            })
+            if needs_update(manifest, json_path, hash_values(json_string)):
+                os.makedirs(os.path.dirname(json_path), exist_ok=True)
+                write_output_file(json_path, json_string.encode("utf-8"))
+        tagged_pages = paginate(pages, page_size)
+        for page_number, page_chunk in enumerate(tagged_pages, start=1):
+            pagination = get_pagination(f"tagged/{tag}/", page_number, len(tagged_pages))
+            html_path = pagination["page_paths"][page_number - 1] + "index.html"
+            # Tagged pages list the title and post date of each tagged page, and include the info for the latest page
+            tag_key = hash_values(
+                global_key, tag, pagination, [(p.page_name, p.page_title, p.post_date) for p in page_chunk],
+                last_comic_page_key
+            )
+            if not needs_update(manifest, html_path, tag_key):
+                continue
+            if page_number == 1:
+                print("Writing tagged page for {}...".format(tag))
+            else:
+                print("Writing tagged page {} for {}...".format(page_number, tag))
+            data_dict = {
+                "tag": tag,
+                "tagged_pages": page_chunk,
+                "pagination": pagination
+            }
+            data_dict.update(last_comic_page.to_template_values())
+            write_to_template("tagged.tpl", html_path, data_dict, global_values)
+
+
+def write_to_template(template_path, html_path, data_dict=None, global_values=None):
+    """
+    Renders a template to an HTML file.
+    :param data_dict: The values for this page
+    :param global_values: The values that are the same for every page, like the site links. They're passed to the
+    template along with the page's own values, instead of being copied into every page beforehand.
+    """
     if data_dict is None:
         data_dict = {}
+    if global_values:
+        data_dict = dict(global_values, **data_dict)
+    from jinja2 import TemplateNotFound
     try:
-        template = JINJA_ENVIRONMENT.get_template(template_path)
+        template = get_jinja_environment().get_template(template_path)
     except TemplateNotFound:
         print("Template file {} not found".format(template_path))
     else:
         dir_name = os.path.dirname(html_path)
         if dir_name:
             os.makedirs(dir_name, exist_ok=True)
-        with open(html_path, "wb") as f:
+        tracing.count("Templates rendered")
+        with tracing.span("Render " + template_path, path=html_path):
             rendered_template = template.render(**data_dict)
-            f.write(bytes(rendered_template, "utf-8"))
+            if not write_output_file(html_path, bytes(rendered_template, "utf-8")):
+                tracing.count("Unchanged files not rewritten")
+
+
+def get_stage_times(processing_times: List[Tuple[str, float]]) -> List[Tuple[str, float]]:
+    """
+    Converts the list of (stage name, time the stage finished) into a list of (stage name, seconds the stage took),
+    followed by the total time.
+    """
+    stage_times = [
+        (name, t - last_processed_time)
+        for (name, t), (_, last_processed_time) in zip(processing_times[1:], processing_times)
+    ]
+    stage_times.append(("Total time", processing_times[-1][1] - processing_times[0][1]))
+    return stage_times
 
 
-def print_processing_times(processing_times: List[Tuple[str, float]]):
-    last_processed_time = None
+def print_processing_times(processing_times: List[Tuple[str, float]],
+                           worker_times: Dict[str, Tuple[int, float]] = None):
     print("")
-    for name, t in processing_times:
-        if last_processed_time is not None:
-            print("{}: {:.2f} ms".format(name, (t - last_processed_time) * 1000))
-        last_processed_time = t
-    print("{}: {:.2f} ms".format("Total time", (processing_times[-1][1] - processing_times[0][1]) * 1000))
+    for name, seconds in get_stage_times(processing_times):
+        print("{}: {:.2f} ms".format(name, seconds * 1000))
+    if worker_times:
+        print("")
+        for name, (count, seconds) in worker_times.items():
+            print("{}: {} pages, {:.2f} ms".format(name, count, seconds * 1000))
+
+
+def end_stage(processing_times: List[Tuple[str, float]], name: str):
+    processing_times.append((name, time()))
+    tracing.end_stage(name)
+
+
+def parse_args(args: List[str] = None):
+    parser = ArgumentParser(description="Builds the HTML files for your comic_git website")
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="Ignore the cache of parsed pages, post text, transcripts, and compiled templates from the last build, and "
+             "parse and compile them all again"
+    )
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help='Only rebuild what changed since the last build, even if "Incremental builds" is turned off'
+    )
+    parser.add_argument(
+        "--trace", metavar="PATH",
+        help="Record how long each stage, page, image, and Markdown file takes to build, and save it to PATH"
+    )
+    parser.add_argument(
+        "--trace-format", choices=("chrome", "json"), default="chrome",
+        help="Save the trace in the Chrome trace format (for chrome://tracing or Perfetto), or as a JSON profile"
+    )
+    parser.add_argument(
+        "--trace-memory", action="store_true",
+        help="Also record the peak memory used by each stage when tracing. This makes the build much slower."
+    )
+    parser.add_argument(
+        "--trace-top", type=int, default=10, metavar="N", help="Number of slowest pages to list when tracing"
+    )
+    return parser.parse_args(args)
 
 
-def main():
-    global BASE_DIRECTORY
-    processing_times = [("Start", time())]
+def main(args: List[str] = None, warm_state: Dict = None) -> List[Tuple[str, float]]:
+    """
+    Builds the whole site from the current directory.
+    :param args: Command line arguments to use instead of the ones in sys.argv
+    :param warm_state: A dict that's kept between builds by a long-running process (see watch.py). The build manifest
+    and content cache are kept in it, so the next build doesn't have to load them from disk. A "content_index" from a
+    scan made just before the build can be put in it too, so the build doesn't scan the content folders again.
+    :return: The name of each stage of the build, and the time it finished, so benchmarks can time each stage
+    """
+    if warm_state is None:
+        warm_state = {}
+    global BASE_DIRECTORY, IMPORT_TIME_REPORTED
+    args = parse_args(args)
+    if args.trace:
+        tracing.start_tracing(args.trace_memory)
+    start_time = time()
+    processing_times = [("Start", start_time)]
+    if not IMPORT_TIME_REPORTED:
+        # Count importing the build scripts as the first stage of the first build in this process
+        processing_times = [("Start", start_time - IMPORT_SECONDS), ("Import build scripts", start_time)]
+        IMPORT_TIME_REPORTED = True
+    set_template_cache(not args.no_cache)
 
     # Get site-wide settings for this comic
     comic_info = read_info("your_content/comic_info.ini")
     comic_url, BASE_DIRECTORY = get_comic_url(comic_info)
+    set_minify_output(comic_info.getboolean("Build Settings", "Minify output", fallback=False))
+
+    end_stage(processing_times, "Get comic settings")
 
-    processing_times.append(("Get comic settings", time()))
+    # Load the manifest from the last build before the output file space gets cleaned up. If we're not doing an
+    # incremental build, forget what the last build wrote so everything is rebuilt.
+    incremental = args.incremental or comic_info.getboolean("Build Settings", "Incremental builds", fallback=False)
+    manifest = load_manifest(keep_outputs=incremental, last_manifest=warm_state.get("manifest"))
+    # Scan all the content once, so later stages don't have to keep checking the file system for each page
+    content_index = warm_state.pop("content_index", None) or scan_content_tree(get_content_roots(comic_info))
+    manifest["content_index"] = content_index
+    global_key = get_global_key(manifest, comic_url)
+    content_cache = load_content_cache(manifest, enabled=not args.no_cache,
+                                       last_content_cache=warm_state.get("content_cache"))
 
     # Setup output file space
-    setup_output_file_space(comic_info)
-    processing_times.append(("Setup output file space", time()))
+    setup_output_file_space(comic_info, manifest, incremental)
+    end_stage(processing_times, "Setup output file space")
 
     # Get the info for all pages, sorted by Post Date
-    page_info_list, scheduled_post_count = get_page_info_list(comic_info)
+    page_info_list, scheduled_post_count, post_dates = get_page_info_list(comic_info, content_cache, content_index)
     print([p["page_name"] for p in page_info_list])
-    processing_times.append(("Get info for all pages", time()))
+    end_stage(processing_times, "Get info for all pages")
 
-    # Save page_info_list.json file for use by other pages
-    save_page_info_json_file(page_info_list, scheduled_post_count)
-    processing_times.append(("Save page_info_list.json file", time()))
+    # Get the size of each comic image, and the responsive versions of them that will be created
+    add_image_info(comic_info, page_info_list, content_cache)
+    end_stage(processing_times, "Get comic image info")
 
-    # Build full comic data dicts, to build templates with
-    comic_data_dicts = build_comic_data_dicts(comic_info, page_info_list)
-    processing_times.append(("Build full comic data dicts", time()))
+    # Save page_info_list.json file for use by other pages, and split it up for the infinite scroll page
+    save_page_info_json_file(page_info_list, scheduled_post_count, manifest)
+    save_page_info_chunks(page_info_list, scheduled_post_count,
+                          comic_info.getint("Build Settings", "Page info chunk size", fallback=50), manifest)
+    end_stage(processing_times, "Save page_info_list.json file")
+
+    # Build the list of comic pages, to build templates with. It only holds what the cross-page templates need
+    # (ids, storylines, tags, etc.). Each page's post text and transcripts are loaded while that page is written.
+    comic_pages = build_comic_pages(comic_info, page_info_list, post_dates)
+    del page_info_list, post_dates
+    end_stage(processing_times, "Build comic page list")
 
     # Create low-res and thumbnail versions of all the comic pages
-    process_comic_images(comic_info, comic_data_dicts)
-    processing_times.append(("Process comic images", time()))
+    process_comic_images(comic_info, comic_pages, manifest)
+    end_stage(processing_times, "Process comic images")
+
+    # Split the other transcript languages out of the comic pages
+    write_transcript_fragments(comic_info, comic_pages, manifest)
+    end_stage(processing_times, "Write transcript fragments")
+
+    # Work out which archive page each storyline starts on
+    storylines = get_storylines(comic_pages)
+    add_storyline_archive_paths(comic_pages, storylines,
+                                comic_info.getint("Archive", "Archive page size", fallback=0))
+    add_next_page_images(comic_pages)
 
     # Write page info to comic HTML pages
     global_values = {
@@ -420,19 +971,42 @@ def main():
         "base_dir": BASE_DIRECTORY,
         "links": get_links_list(comic_info),
         "use_thumbnails": comic_info.getboolean("Archive", "Use thumbnails"),
-        "storylines": get_storylines(comic_data_dicts),
+        "storylines": storylines,
+        "prefetch_next_page": comic_info.getboolean("Comic Settings", "Prefetch next page", fallback=False),
         "google_analytics_id": (comic_info.get("Google Analytics", "Tracking ID")
                                 if comic_info.has_option("Google Analytics", "Tracking ID") else "")
     }
-    write_html_files(comic_info, comic_data_dicts, global_values)
-    processing_times.append(("Write HTML files", time()))
+    worker_times = write_html_files(comic_info, comic_pages, global_values, manifest, global_key, content_cache)
+    end_stage(processing_times, "Write HTML files")
 
     # Build RSS feed
-    build_rss_feed(comic_info, comic_data_dicts)
-    processing_times.append(("Build RSS feed", time()))
-
-    print_processing_times(processing_times)
-
+    build_rss_feed(comic_info, comic_pages, storylines, manifest, global_key,
+                   lambda pages: with_page_content(comic_info, pages, content_cache, content_index))
+    end_stage(processing_times, "Build RSS feed")
+
+    # Minify the output files and write compressed copies of them, if turned on
+    compress_output_files(comic_info, manifest)
+    end_stage(processing_times, "Minify and compress output files")
+
+    # Clean up anything the last build wrote that's no longer needed, list which files changed for deploys, and save
+    # what this build wrote for next time
+    delete_stale_outputs(manifest)
+    save_deploy_delta(record_output_files(manifest))
+    save_manifest(manifest)
+    save_content_cache(content_cache, [comic_page.page_name for comic_page in comic_pages])
+    warm_state["manifest"] = manifest
+    warm_state["content_cache"] = content_cache
+    end_stage(processing_times, "Save build manifest and cache")
+
+    print_processing_times(processing_times, worker_times)
+    if args.trace:
+        tracing.print_trace_summary(args.trace_top)
+        tracing.save_trace(args.trace, args.trace_format)
+        tracing.stop_tracing()
+    return processing_times
+
+
+IMPORT_SECONDS = time() - IMPORT_START_TIME
 
 if __name__ == "__main__":
     main()
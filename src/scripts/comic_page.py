@@ -0,0 +1,56 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+@dataclass
+class ComicPage:
+    """
+    Everything about a single comic page that's needed to build the site. Slots keep each page small, which adds up
+    for comics with tens of thousands of pages, and site-wide values (links, storylines, etc.) are passed to templates
+    separately instead of being copied into every page.
+
+    Templates can use `page.page_name` or `page["page_name"]`, because Jinja falls back to attributes for both.
+    """
+    __slots__ = (
+        "page_name", "filename", "comic_path", "thumbnail_path", "alt_text", "first_id", "previous_id", "current_id",
+        "next_id", "last_id", "page_title", "post_date", "post_datetime", "archive_post_date", "storyline",
+        "characters", "tags", "post_html", "transcripts", "image_width", "image_height", "image_variants",
+        "thumbnail_width", "storyline_archive_path", "next_page_image",
+    )
+    page_name: str
+    filename: str
+    comic_path: str
+    thumbnail_path: str
+    alt_text: str
+    first_id: str
+    previous_id: str
+    current_id: str
+    next_id: str
+    last_id: str
+    page_title: str
+    # The post date as written in info.ini, and parsed once when the page list is read
+    post_date: str
+    post_datetime: datetime
+    archive_post_date: str
+    storyline: Optional[str]
+    characters: List[str]
+    tags: List[str]
+    # The post text and transcripts are only loaded while the page is being written, and are None the rest of the time
+    post_html: Optional[str]
+    # Language -> transcript HTML. Languages that are loaded on demand by transcript.js are None.
+    transcripts: Optional[Dict[str, Optional[str]]]
+    image_width: Optional[int]
+    image_height: Optional[int]
+    image_variants: List[Dict]
+    thumbnail_width: Optional[int]
+    # The archive page that this page's storyline starts on
+    storyline_archive_path: str
+    # The src, srcset and sizes of the next page's image, so this page can prefetch it. None on the last page.
+    next_page_image: Optional[Dict[str, str]]
+
+    def to_template_values(self) -> Dict:
+        """
+        Returns this page's values as a dict, to pass to a template. Only the top level is copied.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
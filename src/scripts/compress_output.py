@@ -0,0 +1,253 @@
+"""
+An optional last stage of the build, which minifies the HTML, JSON and XML files the build wrote, and writes gzip and
+brotli compressed copies of them next to them (e.g. index.html.gz), for web servers and CDNs that can serve
+precompressed files. Turned on with "Minify output" and "Precompress output" in the [Build Settings] section.
+The build writes its own files through write_output_file() and open_output_file(), which minify them as they're
+written, so unchanged files match what's already on disk and aren't rewritten.
+"""
+
+import gzip
+import os
+import re
+from configparser import RawConfigParser
+from contextlib import contextmanager
+from hashlib import sha1
+from io import StringIO
+from json import dumps, loads
+from typing import Callable, Dict, Iterator, Optional, TextIO, Tuple
+
+from build_manifest import hash_values, sha1_file
+from utils import get_worker_count, open_if_changed, write_file_if_changed
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+SECTION = "Build Settings"
+# Bump this whenever the way files are minified or compressed changes, so every file gets processed again
+COMPRESS_OUTPUT_VERSION = 1
+OUTPUT_EXTENSIONS = (".html", ".json", ".xml")
+# Whitespace in these HTML elements matters, so they're never minified
+RAW_HTML_ELEMENT = re.compile(r"<(pre|textarea|script|style)\b.*?</\1\s*>", re.DOTALL | re.IGNORECASE)
+CDATA_SECTION = re.compile(r"<!\[CDATA\[.*?\]\]>", re.DOTALL)
+# Set from "Minify output" by set_minify_output(), so the build writes its files already minified. Otherwise each file
+# it writes would differ from the minified copy the last build left behind, and be rewritten and minified again.
+MINIFY_OUTPUT = False
+# Output path -> its size before and after it was minified, for every file minified as it was written by this build (or
+# by this worker process, until take_minified_sizes() is called)
+MINIFIED_SIZES = {}
+
+
+def minify_outside(text: str, protected: re.Pattern, minify: Callable[[str], str]) -> str:
+    """
+    Minifies everything in `text` except the parts that match `protected`
+    """
+    result = []
+    last_end = 0
+    for match in protected.finditer(text):
+        result.append(minify(text[last_end:match.start()]))
+        result.append(match.group(0))
+        last_end = match.end()
+    result.append(minify(text[last_end:]))
+    return "".join(result)
+
+
+def minify_html(text: str) -> str:
+    # Collapse indentation and blank lines into a single line break. HTML treats any run of whitespace the same as a
+    # single space, so this never changes how the page looks.
+    return minify_outside(text, RAW_HTML_ELEMENT, lambda s: re.sub(r"[ \t\r]*\n\s*", "\n", s))
+
+
+def minify_xml(text: str) -> str:
+    # Whitespace between RSS elements doesn't mean anything. Post HTML is inside CDATA sections, so leave those alone.
+    return minify_outside(text, CDATA_SECTION, lambda s: re.sub(r">\s+<", "><", s))
+
+
+def minify_json(text: str) -> str:
+    return dumps(loads(text), separators=(",", ":"))
+
+
+MINIFIERS = {
+    ".html": minify_html,
+    ".json": minify_json,
+    ".xml": minify_xml,
+}
+
+
+def set_minify_output(enabled: bool):
+    """
+    Turns minifying files as they're written on or off, and forgets the sizes recorded by the last build
+    """
+    global MINIFY_OUTPUT
+    MINIFY_OUTPUT = enabled
+    MINIFIED_SIZES.clear()
+
+
+def take_minified_sizes() -> Dict[str, Tuple[int, int]]:
+    """
+    Returns the sizes of the files minified so far in this process, and forgets them. Used by worker processes to send
+    them back to the main process, which adds them to its own with add_minified_sizes().
+    """
+    sizes = dict(MINIFIED_SIZES)
+    MINIFIED_SIZES.clear()
+    return sizes
+
+
+def add_minified_sizes(sizes: Dict[str, Tuple[int, int]]):
+    MINIFIED_SIZES.update(sizes)
+
+
+def minify_output(path: str, data: bytes) -> bytes:
+    """
+    Minifies the contents of an output file before it's written, if "Minify output" is turned on. Its size before and
+    after is recorded, so compress_output_files() can report how much was saved without minifying it again.
+    """
+    minifier = MINIFIERS.get(os.path.splitext(path)[1])
+    if not MINIFY_OUTPUT or minifier is None:
+        return data
+    minified = minifier(data.decode("utf-8")).encode("utf-8")
+    MINIFIED_SIZES[path] = (len(data), len(minified))
+    return minified
+
+
+def write_output_file(path: str, data: bytes) -> bool:
+    """
+    Like write_file_if_changed(), but minifies the file first if "Minify output" is turned on, so it's compared with
+    the file on disk the way it'll actually be written.
+    :return: True if the file was written
+    """
+    return write_file_if_changed(path, minify_output(path, data))
+
+
+@contextmanager
+def open_output_file(path: str) -> Iterator[TextIO]:
+    """
+    Like open_if_changed(), but minifies the file first if "Minify output" is turned on. The minifiers need the whole
+    file at once, so it's built in memory in that case.
+    """
+    if not MINIFY_OUTPUT:
+        with open_if_changed(path) as f:
+            yield f
+        return
+    f = StringIO()
+    yield f
+    write_output_file(path, f.getvalue().encode("utf-8"))
+
+
+def process_output_file(path: str, minify: bool,
+                        precompress: bool) -> Tuple[str, int, int, Dict[str, int], str]:
+    """
+    Minifies a file in place and writes its compressed copies.
+    :return: The path, the original size, the minified size, a dict of compressed file extension to size, and the
+    SHA1 of the file as it was left
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    original_size = len(data)
+    if minify:
+        data = MINIFIERS[os.path.splitext(path)[1]](data.decode("utf-8")).encode("utf-8")
+        write_file_if_changed(path, data)
+    compressed_sizes = {}
+    if precompress:
+        # mtime=0 so the same file always compresses to the same bytes
+        compressed = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed[".br"] = brotli.compress(data, quality=11)
+        for extension, compressed_data in compressed.items():
+            write_file_if_changed(path + extension, compressed_data)
+            compressed_sizes[extension] = len(compressed_data)
+    return path, original_size, len(data), compressed_sizes, sha1(data).hexdigest()
+
+
+def get_output_hash(manifest: Dict, path: str) -> Optional[str]:
+    """
+    Returns the SHA1 of an output file, or None if it doesn't exist. The hash recorded for the deploy delta by the last
+    build is used if the file's size and modification time haven't changed since.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    cached = manifest["previous"]["output_files"].get(path)
+    if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+    return sha1_file(path)
+
+
+def compress_output_files(comic_info: RawConfigParser, manifest: Dict):
+    """
+    Minifies and precompresses the files written by the build, depending on the settings in comic_info.ini. Files
+    whose contents haven't changed since they were last processed are skipped, even if they were rewritten. Files this
+    build already minified as it wrote them (see write_output_file()) aren't minified again.
+    :param manifest: The build manifest. Every file it lists as an output is processed, and the compressed copies are
+    added to it as outputs too, so they're deleted along with the file they were made from.
+    """
+    minify = comic_info.getboolean(SECTION, "Minify output", fallback=False)
+    precompress = comic_info.getboolean(SECTION, "Precompress output", fallback=False)
+    if not minify and not precompress:
+        return
+    if precompress and brotli is None:
+        print("The brotli package isn't installed, so only .gz files will be created")
+    compressed_extensions = []
+    if precompress:
+        compressed_extensions.append(".gz")
+        if brotli is not None:
+            compressed_extensions.append(".br")
+    settings_key = hash_values(COMPRESS_OUTPUT_VERSION, minify, compressed_extensions)
+    minified_sizes = MINIFIED_SIZES if minify else {}
+    paths = [p for p in manifest["outputs"] if os.path.splitext(p)[1] in OUTPUT_EXTENSIONS]
+    jobs = []
+    skipped_count = 0
+    # Files minified as they were written count towards what minifying saved, along with the ones minified here
+    minified_count, total_original, total_minified = 0, 0, 0
+    for path in paths:
+        digest = get_output_hash(manifest, path)
+        if digest is None:
+            continue
+        for extension in compressed_extensions:
+            manifest["outputs"][path + extension] = settings_key
+        previous = manifest["previous"]["compressed"].get(path)
+        if previous == [digest, settings_key] and all(os.path.isfile(path + e) for e in compressed_extensions):
+            manifest["compressed"][path] = previous
+            skipped_count += 1
+            continue
+        if path in minified_sizes:
+            minified_count += 1
+            total_original += minified_sizes[path][0]
+            total_minified += minified_sizes[path][1]
+            if not precompress:
+                # Already minified as it was written, so there's nothing left to do
+                manifest["compressed"][path] = [digest, settings_key]
+                continue
+        jobs.append(path)
+
+    workers = get_worker_count(comic_info, "Compression workers")
+    if workers > 1 and len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(process_output_file, jobs, [minify and p not in minified_sizes for p in jobs],
+                                    [precompress] * len(jobs), chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        results = [process_output_file(path, minify and path not in minified_sizes, precompress) for path in jobs]
+
+    total_uncompressed, total_compressed = 0, {}
+    for path, original_size, minified_size, compressed_sizes, digest in results:
+        manifest["compressed"][path] = [digest, settings_key]
+        if minify and path not in minified_sizes:
+            minified_count += 1
+            total_original += original_size
+            total_minified += minified_size
+        total_uncompressed += minified_size
+        for extension, size in compressed_sizes.items():
+            total_compressed[extension] = total_compressed.get(extension, 0) + size
+    if skipped_count:
+        print("Skipped {} unchanged output files".format(skipped_count))
+    if minified_count:
+        print("Minified {} files: {:,} -> {:,} bytes (saved {:,} bytes)".format(
+            minified_count, total_original, total_minified, total_original - total_minified
+        ))
+    for extension, size in total_compressed.items():
+        print("Compressed {} files to {}: {:,} -> {:,} bytes (saved {:,} bytes)".format(
+            len(results), extension, total_uncompressed, size, total_uncompressed - size
+        ))
@@ -0,0 +1,127 @@
+import os
+import shutil
+from importlib.util import find_spec
+from json import dumps, load, loads
+from typing import Any, Callable, Dict, Iterable, List
+
+from build_manifest import CACHE_DIRECTORY, hash_file, hash_values
+from utils import write_file_if_changed
+
+CONTENT_CACHE_PATH = os.path.join(CACHE_DIRECTORY, "content_cache.json")
+# Large values that belong to a single page (post HTML and transcripts) are kept in a small file per value in this
+# folder, instead of in content_cache.json, so they're only read into memory while that page is being used
+PAGE_CACHE_DIRECTORY = os.path.join(CACHE_DIRECTORY, "pages")
+# Bump this whenever the way page content is parsed or rendered changes, so old cached values aren't used
+CONTENT_CACHE_VERSION = 3
+
+
+def get_markdown2_fingerprint() -> str:
+    """
+    Identifies the installed version of markdown2 without importing it, because importing it is slow and builds where
+    all the post text is cached don't need it at all. Upgrading markdown2 replaces its source file, which changes this.
+    """
+    spec = find_spec("markdown2")
+    if spec is None or not spec.origin:
+        return ""
+    stat = os.stat(spec.origin)
+    return hash_values(spec.origin, stat.st_size, stat.st_mtime_ns)
+
+
+def get_cache_version() -> str:
+    # Cached post HTML depends on the version of markdown2 that rendered it
+    return hash_values(CONTENT_CACHE_VERSION, get_markdown2_fingerprint())
+
+
+def load_content_cache(manifest: Dict, enabled: bool = True, last_content_cache: Dict = None) -> Dict:
+    """
+    Loads the cache of parsed info.ini files, image sizes, and other small values from the last build. Each cached value
+    is stored with the hashes of the files it was built from, and is only used if none of those files have changed.
+    Each page's post HTML and transcripts are cached separately, see get_page_cached().
+    :param manifest: The build manifest for this build. Its file hash cache is used to check if files have changed.
+    :param enabled: If False, the cache from the last build is ignored, so everything is parsed from scratch.
+    :param last_content_cache: The last build's cache, if it's still in memory (e.g. in watch mode). If given, the
+    cache isn't loaded from disk.
+    :return:
+    """
+    previous = {}
+    if enabled and last_content_cache is not None:
+        previous = last_content_cache["entries"]
+    elif enabled and os.path.isfile(CONTENT_CACHE_PATH):
+        try:
+            with open(CONTENT_CACHE_PATH, encoding="utf-8") as f:
+                loaded = load(f)
+        except ValueError:
+            print(f"Couldn't parse {CONTENT_CACHE_PATH}, ignoring it")
+        else:
+            if loaded.get("version") == get_cache_version():
+                previous = loaded["entries"]
+    return {
+        "manifest": manifest,
+        "version": get_cache_version(),
+        "enabled": enabled,
+        "entries": {},
+        "previous": previous,
+        "hits": 0,
+        "misses": 0,
+    }
+
+
+def save_content_cache(content_cache: Dict, page_names: Iterable[str] = None):
+    """
+    Saves the cache for the next build. Only the values used by this build are saved, so values for pages that were
+    deleted or renamed are evicted.
+    :param page_names: Every page in this build. If given, the cached values of any other pages are deleted. Values
+    of pages that this build didn't need to look at are kept.
+    """
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    with open(CONTENT_CACHE_PATH, "w", encoding="utf-8") as f:
+        f.write(dumps({"version": content_cache["version"], "entries": content_cache["entries"]}))
+    if page_names is not None and os.path.isdir(PAGE_CACHE_DIRECTORY):
+        page_names = set(page_names)
+        for entry in os.scandir(PAGE_CACHE_DIRECTORY):
+            if entry.name not in page_names:
+                shutil.rmtree(entry.path, ignore_errors=True)
+    print("Content cache: {} hits, {} misses".format(content_cache["hits"], content_cache["misses"]))
+
+
+def get_cached(content_cache: Dict, key: str, input_paths: List[str], build_value: Callable[[], Any]) -> Any:
+    """
+    Returns the cached value for `key` if it was built from the same files, in the same state, as `input_paths` are now.
+    Otherwise, calls `build_value()` and caches what it returns. Values must be JSON-serializable, and callers must not
+    modify the values returned, because they're shared with the cache.
+    """
+    inputs = {path: hash_file(content_cache["manifest"], path) for path in input_paths}
+    entry = content_cache["previous"].get(key)
+    if entry is not None and entry["inputs"] == inputs:
+        content_cache["hits"] += 1
+    else:
+        content_cache["misses"] += 1
+        entry = {"inputs": inputs, "value": build_value()}
+    content_cache["entries"][key] = entry
+    return entry["value"]
+
+
+def get_page_cached(content_cache: Dict, page_name: str, name: str, input_paths: List[str],
+                    build_value: Callable[[], Any]) -> Any:
+    """
+    The same as get_cached(), but for a large value that belongs to a single page. The value is kept in its own file,
+    and is read from it each time it's needed instead of being held in memory for the whole build.
+    """
+    inputs = {path: hash_file(content_cache["manifest"], path) for path in input_paths}
+    cache_path = os.path.join(PAGE_CACHE_DIRECTORY, page_name, name + ".json")
+    entry = None
+    if content_cache["enabled"]:
+        try:
+            with open(cache_path, "rb") as f:
+                entry = loads(f.read().decode("utf-8"))
+        except (OSError, ValueError):
+            pass
+    if entry is not None and entry.get("version") == content_cache["version"] and entry["inputs"] == inputs:
+        content_cache["hits"] += 1
+        return entry["value"]
+    content_cache["misses"] += 1
+    value = build_value()
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    entry = {"version": content_cache["version"], "inputs": inputs, "value": value}
+    write_file_if_changed(cache_path, dumps(entry).encode("utf-8"))
+    return value
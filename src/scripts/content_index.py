@@ -0,0 +1,84 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+
+def scan_content_tree(roots: List[str]) -> Dict:
+    """
+    Walks each of the given directories once with os.scandir(), and records every file and directory in them along
+    with each file's size and modification time. Later build stages look files up in this index instead of calling
+    glob(), os.path.exists() or os.stat() for every page.
+    :param roots: Directories to scan, e.g. ["your_content", "src/templates"]. Missing directories are skipped.
+    :return: A dict with the scanned roots, a dict of file path to (size, mtime_ns), and a dict of directory path to
+    the names of the subdirectories and files in that directory. All paths are normalized with os.path.normpath().
+    """
+    index = {"roots": [], "files": {}, "dirs": {}}
+    for root in roots:
+        root = os.path.normpath(root)
+        # Skip folders that were already scanned as part of an earlier root, e.g. the default transcripts folder
+        if is_indexed(index, root):
+            continue
+        index["roots"].append(root)
+        scan_directory(index, root)
+    return index
+
+
+def scan_directory(index: Dict, dir_path: str):
+    try:
+        entries = os.scandir(dir_path)
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    subdirs, files = [], []
+    with entries:
+        for entry in entries:
+            entry_path = os.path.join(dir_path, entry.name)
+            if entry.is_dir():
+                subdirs.append(entry.name)
+            else:
+                # On Windows, scandir gets this from the directory listing, so it doesn't cost an extra system call
+                stat = entry.stat()
+                index["files"][entry_path] = (stat.st_size, stat.st_mtime_ns)
+                files.append(entry.name)
+    index["dirs"][dir_path] = {"subdirs": sorted(subdirs), "files": sorted(files)}
+    for name in subdirs:
+        scan_directory(index, os.path.join(dir_path, name))
+
+
+def is_indexed(index: Dict, path: str) -> bool:
+    return any(path == root or path.startswith(root + os.sep) for root in index["roots"])
+
+
+def get_stat(index: Optional[Dict], path: str) -> Optional[Tuple[int, int]]:
+    """
+    Returns the (size, mtime_ns) of a file, or None if it doesn't exist. Files outside of the scanned directories are
+    looked up on disk.
+    """
+    if index is not None:
+        path = os.path.normpath(path)
+        if path in index["files"]:
+            return index["files"][path]
+        if is_indexed(index, path):
+            return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def file_exists(index: Dict, path: str) -> bool:
+    return get_stat(index, path) is not None
+
+
+def list_subdirectories(index: Dict, dir_path: str) -> List[str]:
+    listing = index["dirs"].get(os.path.normpath(dir_path))
+    return listing["subdirs"] if listing else []
+
+
+def list_files(index: Dict, dir_path: str) -> List[str]:
+    listing = index["dirs"].get(os.path.normpath(dir_path))
+    return listing["files"] if listing else []
+
+
+def list_files_recursive(index: Dict, dir_path: str) -> List[str]:
+    dir_path = os.path.normpath(dir_path)
+    return sorted(path for path in index["files"] if path.startswith(dir_path + os.sep))
@@ -1,111 +1,375 @@
-import glob
+"""
+Imports the comic pages from a WordPress export (made with Tools -> Export in WordPress) of a site that uses the
+Webcomic plugin. Each comic post becomes a folder in your_content/comics with an info.ini, a post.txt, and the comic
+image, which is downloaded from the WordPress site.
+
+The export is read one item at a time, so even exports of huge sites use very little memory, and images are downloaded
+several at a time. Every page that's finished is written to a journal, so if the import is stopped or fails partway
+through, running it again picks up where it left off.
+
+Usage: python src/scripts/export_wordpress.py tamberlane.WordPress.2020-06-13.xml [--workers 8]
+                                              [--base-url http://localhost:8000/] [--restart]
+Run with --help to see all the options.
+"""
+
 import os
 import shutil
-import time
-from collections import defaultdict
-from urllib.request import urlretrieve
-from xml.etree import ElementTree as ET
-
+from argparse import ArgumentParser
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from configparser import RawConfigParser
+from datetime import datetime
+from json import dumps, loads
+from time import sleep
+from typing import Dict, Iterator, List, Optional, Set
+from urllib.error import HTTPError
+from urllib.parse import unquote, urlsplit, urlunsplit
+from urllib.request import urlopen
+from xml.etree.ElementTree import Element, iterparse
 
+from content_cache import CACHE_DIRECTORY
+from utils import remove_if_exists, write_file_if_changed
 
 WEBCOMIC_POST_TYPE = "webcomic1"
 ATTACHMENT_POST_TYPE = "attachment"
+# Posts with any other status (drafts, trashed posts, etc.) aren't imported
+IMPORTED_STATUSES = ("publish", "future")
+WORDPRESS_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+DEFAULT_JOURNAL_PATH = os.path.join(CACHE_DIRECTORY, "wordpress_import.jsonl")
+# Suffixes WordPress and the Webcomic plugin add to attachment names, e.g. page-12-ks for a Kickstarter version of
+# page-12. Only used to match up attachments that aren't attached to their comic post.
+ATTACHMENT_NAME_SUFFIXES = ("-2", "-3", "-ks", "-ks2", "-ggc")
+INFO_INI_TEMPLATE = """Title = {title}
+Post date = {post_date}
+Filename = {filename}
+Alt text = {alt_text}
+Storyline = {storyline}
+Characters = {characters}
+Tags = {tags}
+"""
 
 
-# filename = "tamberlane.WordPress.2020-05-31.xml"
-filename = "tamberlane.WordPress.2020-06-13.xml"
-
-tree = ET.parse(filename)
-root = tree.getroot()
-
-channel = root[0]
-
-pages = defaultdict(dict)
-
-for child in channel.iter('item'):
-    # if child.find("title").text in ["Page 1", "Page 2", "Page 3"]:
-    #     for c in child:
-    #         print(c.tag)
-    #         if c.attrib:
-    #             print(f"\t{repr(c.attrib)}")
-    #         print(f"\t{repr(c.text)}")
-    #     print("")
-
-    post_name = child.find('{http://wordpress.org/export/1.2/}post_name').text
-    if post_name is None:
-        continue
-    post_type = child.find("{http://wordpress.org/export/1.2/}post_type").text
-    if post_type == WEBCOMIC_POST_TYPE:
-        if post_name.endswith("-2"):
-            post_name = post_name[:-2]
-        pages[post_name]["title"] = child.find('title').text
-        pages[post_name]["page_name"] = post_name
-        pages[post_name]["post_date"] = child.find('{http://wordpress.org/export/1.2/}post_date').text
-        pages[post_name]["text_post"] = child.find('{http://purl.org/rss/1.0/modules/content/}encoded').text
-        characters = []
-        for c in child.iter("category"):
-            if c.attrib["domain"].endswith("storyline"):
-                pages[post_name]["storyline"] = c.text
-            elif c.attrib["domain"].endswith("character"):
-                characters.append(c.text)
-            else:
-                print("WHAT IS THIS FUCK")
-                print(c)
-        pages[post_name]["characters"] = characters
-    elif post_type == ATTACHMENT_POST_TYPE:
-        if post_name.endswith("-2"):
-            post_name = post_name[:-2]
-        elif post_name.endswith("-3"):
-            post_name = post_name[:-2]
-        elif post_name.endswith("-ks"):
-            post_name = post_name[:-3]
-        elif post_name.endswith("-ks2"):
-            post_name = post_name[:-4]
-        elif post_name.endswith("-ggc"):
-            post_name = post_name[:-4]
-        post_name = post_name.replace("_", "-")
-        pages[post_name]["attachment_name"] = post_name
-        pages[post_name]["page_link"] = child.find('{http://wordpress.org/export/1.2/}attachment_url').text
-        pages[post_name]["alt_text"] = child.find('{http://wordpress.org/export/1.2/excerpt/}encoded').text
-    # else:
-    #     print(f"Bad post type {post_type} for {child.find('title').text}")
-
-# for f in glob.glob("../../your_content/comics/*"):
-#     shutil.rmtree(f)
-
-for name, page in pages.items():
-    if "page_name" in page:
-        print(name)
-        for k in ["title", "page_name", "post_date", "text_post", "characters", "page_link", "alt_text"]:
-            if k not in page:
-                print(k)
-                print(page)
-                break
-        else:
-            dir_name = f"../../your_content/comics/{name}"
-            os.makedirs(dir_name, exist_ok=True)
-            page_filename = os.path.basename(page["page_link"])
-            page_filepath = dir_name + "/" + page_filename
-            if not os.path.isfile(page_filepath):
-                urlretrieve(page["page_link"], page_filepath)
-            post_date = time.strftime("%B %d, %Y", time.strptime(page["post_date"], "%Y-%m-%d %H:%M:%S"))
-            # Build files
-            with open(dir_name + "/info.ini", "wb") as f:
-                f.write(f"""Title = {page["title"]}
-Post date = {post_date}
-Filename = {page_filename}
-Alt text = {page["alt_text"]}
-Storyline = {page.get("storyline", "")}
-Characters = {", ".join(page["characters"])}
-Tags = """.encode("utf-8"))
-            if not page["text_post"]:
-                page["text_post"] = ""
-            with open(dir_name + "/post.txt", "wb") as f:
-                f.write(page["text_post"].encode("utf-8"))
-
-
-print("")
-folders = glob.glob("../../your_content/comics/*")
-for i in range(1, 219):
-    if f"../../your_content/comics\\page-{i}" not in folders:
-        print(f"Missing page-{i}")
+def local_name(tag: str) -> str:
+    # Strip the namespace, e.g. "{http://wordpress.org/export/1.2/}post_name" -> "post_name". Exports made by different
+    # versions of WordPress use different namespace versions.
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_item(item: Element) -> Dict:
+    """
+    Reads the values the importer needs out of an <item> element, i.e. a single post, page, or attachment
+    """
+    values = {"categories": []}
+    for child in item:
+        name = local_name(child.tag)
+        if name == "category":
+            values["categories"].append((child.get("domain", ""), child.text or ""))
+        elif name == "encoded":
+            # content:encoded is the post text, and excerpt:encoded is the alt text of an attachment
+            values["excerpt" if "excerpt" in child.tag else "content"] = child.text or ""
+        elif name not in values:
+            values[name] = child.text or ""
+    return values
+
+
+def iter_items(export_path: str) -> Iterator[Dict]:
+    """
+    Yields the values of each <item> in the export, one at a time. Each item is thrown away once it's been read, so the
+    whole export is never in memory at once.
+    """
+    channel = None
+    for event, element in iterparse(export_path, events=("start", "end")):
+        if event == "start":
+            if channel is None and local_name(element.tag) == "channel":
+                channel = element
+            continue
+        if local_name(element.tag) == "item":
+            yield parse_item(element)
+            if channel is not None:
+                channel.clear()
+
+
+def get_page_name(post_name: str) -> str:
+    # WordPress adds -2 to the names of posts that were imported twice
+    if post_name.endswith("-2"):
+        return post_name[:-2]
+    return post_name
+
+
+def get_attachment_page_name(post_name: str) -> str:
+    """
+    Guesses the name of the page an attachment belongs to, from the attachment's name
+    """
+    for suffix in ATTACHMENT_NAME_SUFFIXES:
+        if post_name.endswith(suffix):
+            post_name = post_name[:-len(suffix)]
+            break
+    return post_name.replace("_", "-")
+
+
+def single_line(text: str) -> str:
+    # info.ini values have to fit on one line
+    return " ".join(text.split())
+
+
+def load_journal(journal_path: str) -> Set[str]:
+    """
+    Returns the names of the pages that were already imported, from the journal written by earlier imports
+    """
+    done = set()
+    if not os.path.isfile(journal_path):
+        return done
+    with open(journal_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(loads(line)["page"])
+            except (ValueError, KeyError):
+                # The last line can be cut off if the import was killed while writing it
+                continue
+    return done
+
+
+def get_download_url(url: str, base_url: Optional[str]) -> str:
+    """
+    Replaces the scheme and domain of an attachment URL with those in `base_url`, if given. Useful for downloading the
+    images from a local copy of a WordPress site's uploads instead of the live site.
+    """
+    if not base_url:
+        return url
+    base = urlsplit(base_url)
+    parts = urlsplit(url)
+    return urlunsplit((base.scheme, base.netloc, base.path.rstrip("/") + parts.path, parts.query, ""))
+
+
+def download_file(url: str, path: str, timeout: float, retries: int) -> int:
+    """
+    Downloads a file to a temporary file next to `path`, then moves it to `path` once it's complete, so an interrupted
+    download never leaves a partial image behind. Failed downloads are retried, with a growing delay between tries,
+    unless the server says the file doesn't exist.
+    :return: The size of the file
+    """
+    temp_path = path + ".part"
+    for attempt in range(retries + 1):
+        try:
+            with urlopen(url, timeout=timeout) as response, open(temp_path, "wb") as f:
+                shutil.copyfileobj(response, f, 1024 * 1024)
+            os.replace(temp_path, path)
+            return os.path.getsize(path)
+        except OSError as e:
+            remove_if_exists(temp_path)
+            if attempt == retries or (isinstance(e, HTTPError) and 400 <= e.code < 500):
+                raise
+            sleep(0.5 * 2 ** attempt)
+
+
+def get_spool_dir(journal_path: str) -> str:
+    # Post text waiting for its comic image is kept next to the journal, e.g. .build_cache/wordpress_import_posts
+    return os.path.splitext(journal_path)[0] + "_posts"
+
+
+def spool_page_text(spool_dir: str, page: Dict):
+    """
+    Moves a page's post text out of memory into a temporary file, until the page's comic image shows up
+    """
+    page["post_text_path"] = os.path.join(spool_dir, page["post_id"] + ".txt")
+    with open(page["post_text_path"], "wb") as f:
+        f.write(page.pop("content").encode("utf-8"))
+
+
+def write_page_text(page_dir: str, page: Dict):
+    with open(page["post_text_path"], "rb") as f:
+        write_file_if_changed(os.path.join(page_dir, "post.txt"), f.read())
+    os.remove(page["post_text_path"])
+
+
+def write_page_info(page_dir: str, page: Dict, attachment: Dict, filename: str, date_format: str):
+    categories = page["categories"]
+    storylines = [text for domain, text in categories if domain.endswith("storyline")]
+    info = INFO_INI_TEMPLATE.format(
+        title=single_line(page.get("title", "")),
+        post_date=datetime.strptime(page["post_date"], WORDPRESS_DATE_FORMAT).strftime(date_format),
+        filename=filename,
+        alt_text=single_line(attachment.get("excerpt", "")),
+        storyline=single_line(storylines[0]) if storylines else "",
+        characters=", ".join(single_line(text) for domain, text in categories if domain.endswith("character")),
+        tags=", ".join(single_line(text) for domain, text in categories if domain == "post_tag"),
+    )
+    write_file_if_changed(os.path.join(page_dir, "info.ini"), info.encode("utf-8"))
+
+
+def import_page(page: Dict, attachment: Dict, settings: Dict) -> Dict:
+    """
+    Downloads the comic image for a page, then writes its post.txt and info.ini. Runs in a worker thread. If the
+    download fails, the page's folder is removed again, unless it was already there.
+    :return: The journal entry for the page
+    """
+    page_dir = os.path.join(settings["output_dir"], page["page_name"])
+    filename = os.path.basename(unquote(urlsplit(attachment["attachment_url"]).path))
+    image_path = os.path.join(page_dir, filename)
+    size = None
+    if not os.path.isfile(image_path):
+        created_page_dir = not os.path.isdir(page_dir)
+        os.makedirs(page_dir, exist_ok=True)
+        url = get_download_url(attachment["attachment_url"], settings["base_url"])
+        try:
+            size = download_file(url, image_path, settings["timeout"], settings["retries"])
+        except BaseException:
+            if created_page_dir:
+                shutil.rmtree(page_dir, ignore_errors=True)
+            raise
+    write_page_text(page_dir, page)
+    # Written last, so a page folder without an info.ini is never mistaken for a finished page
+    write_page_info(page_dir, page, attachment, filename, settings["date_format"])
+    return {"page": page["page_name"], "filename": filename, "downloaded_bytes": size}
+
+
+def import_wordpress_export(export_path: str, settings: Dict, journal_path: str, workers: int) -> Counter:
+    """
+    Imports every published comic post in the export. Posts are matched up with their comic image by the image's parent
+    post, or by name if the image isn't attached to a post. Each page is handed off to a pool of `workers` threads as
+    soon as both have been read, and no more than a few pages per worker are queued up at once, so memory use doesn't
+    grow with the size of the export.
+    :return: Counts of pages imported, skipped, and failed, and bytes downloaded
+    """
+    stats = Counter()
+    done = load_journal(journal_path)
+    spool_dir = get_spool_dir(journal_path)
+    # Comic posts and attachments that haven't been matched up yet, by post ID and by name
+    pages_by_id = {}
+    page_ids_by_name = {}
+    attachments_by_parent = {}
+    attachments_by_name = {}
+    in_flight = {}
+
+    def handle_finished(futures: Set[Future]):
+        for future in futures:
+            page_name = in_flight.pop(future)
+            try:
+                entry = future.result()
+            except Exception as e:
+                print(f"Failed to import {page_name}: {e}")
+                stats["failed"] += 1
+                continue
+            journal_file.write(dumps(entry) + "\n")
+            journal_file.flush()
+            print(f"Imported {page_name}")
+            stats["imported"] += 1
+            stats["downloaded_bytes"] += entry["downloaded_bytes"] or 0
+
+    def submit(page: Dict, attachment: Dict):
+        while len(in_flight) >= workers * 4:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            handle_finished(finished)
+        in_flight[pool.submit(import_page, page, attachment, settings)] = page["page_name"]
+
+    def match_page(page: Dict):
+        attachment = attachments_by_parent.pop(page["post_id"], None)
+        if attachment is None:
+            pages_by_id[page["post_id"]] = page
+            page_ids_by_name[page["page_name"]] = page["post_id"]
+            return
+        attachments_by_name.pop(attachment["page_name"], None)
+        submit(page, attachment)
+
+    def match_attachment(attachment: Dict):
+        page = pages_by_id.pop(attachment.get("post_parent", ""), None)
+        if page is None:
+            # Only the first image attached to each post is used
+            attachments_by_parent.setdefault(attachment.get("post_parent", ""), attachment)
+            attachments_by_name.setdefault(attachment["page_name"], attachment)
+            return
+        page_ids_by_name.pop(page["page_name"], None)
+        submit(page, attachment)
+
+    os.makedirs(os.path.dirname(journal_path) or ".", exist_ok=True)
+    os.makedirs(spool_dir, exist_ok=True)
+    with open(journal_path, "a", encoding="utf-8") as journal_file, ThreadPoolExecutor(max_workers=workers) as pool:
+        for item in iter_items(export_path):
+            post_name = item.get("post_name")
+            if not post_name:
+                continue
+            post_type = item.get("post_type")
+            if post_type == WEBCOMIC_POST_TYPE:
+                if item.get("status") not in IMPORTED_STATUSES:
+                    continue
+                page_name = get_page_name(post_name)
+                if page_name in done:
+                    stats["skipped"] += 1
+                    continue
+                item["page_name"] = page_name
+                # Spool the post text now, so only the small bits of the post are kept until its image shows up
+                spool_page_text(spool_dir, item)
+                match_page(item)
+            elif post_type == ATTACHMENT_POST_TYPE and item.get("attachment_url"):
+                item["page_name"] = get_attachment_page_name(post_name)
+                item.pop("content", None)
+                match_attachment(item)
+
+        # Fall back to matching the rest by name
+        for page_name, post_id in page_ids_by_name.items():
+            page = pages_by_id.pop(post_id)
+            attachment = attachments_by_name.get(page_name)
+            if attachment is None:
+                print(f"No comic image found for {page_name}")
+                stats["failed"] += 1
+                continue
+            submit(page, attachment)
+        handle_finished(set(wait(in_flight).done))
+    # Post text of pages that were never imported, because they had no image or their download failed
+    shutil.rmtree(spool_dir, ignore_errors=True)
+    return stats
+
+
+def get_default_date_format() -> str:
+    comic_info = RawConfigParser()
+    comic_info.read("your_content/comic_info.ini", encoding="utf-8")
+    return comic_info.get("Comic Settings", "Date format", fallback="%B %d, %Y")
+
+
+def parse_args(args: List[str] = None):
+    parser = ArgumentParser(description="Imports comic pages from a WordPress export into your_content/comics")
+    parser.add_argument("export_path", help="The WordPress export file (.xml)")
+    parser.add_argument("--output", default="your_content/comics", help="Folder to create the comic pages in")
+    parser.add_argument("--workers", type=int, default=8, help="Number of images to download at once")
+    parser.add_argument(
+        "--base-url",
+        help="Download images from this site instead of the one in the export, e.g. a local copy of the WordPress "
+             "site, served at http://localhost:8000/"
+    )
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for a download before retrying it")
+    parser.add_argument("--retries", type=int, default=3, help="Number of times to retry a failed download")
+    parser.add_argument(
+        "--date-format",
+        help='Format to write post dates in. Defaults to "Date format" in the [Comic Settings] section of '
+             'your_content/comic_info.ini.'
+    )
+    parser.add_argument(
+        "--journal", default=DEFAULT_JOURNAL_PATH,
+        help="File that records which pages have been imported, so an interrupted import can pick up where it left off"
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="Forget what earlier imports did, and import every page again"
+    )
+    return parser.parse_args(args)
+
+
+def main(args: List[str] = None) -> Counter:
+    args = parse_args(args)
+    if args.restart:
+        remove_if_exists(args.journal)
+    settings = {
+        "output_dir": args.output,
+        "base_url": args.base_url,
+        "timeout": args.timeout,
+        "retries": args.retries,
+        "date_format": args.date_format or get_default_date_format(),
+    }
+    stats = import_wordpress_export(args.export_path, settings, args.journal, max(args.workers, 1))
+    print("\nImported {} pages ({:,} bytes of images downloaded), skipped {} already imported pages, {} failed".format(
+        stats["imported"], stats["downloaded_bytes"], stats["skipped"], stats["failed"]
+    ))
+    return stats
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,135 @@
 """
-A script for generating a LOT of comic folders and their info.json,
-intended for load testing the archive and tagged pages
+A script for generating a LOT of comic folders and their info.ini files, intended for load testing the archive and
+tagged pages, and for benchmarking the build (see benchmark_build.py)
+
+Usage: python src/scripts/load_test.py [--pages 100] [--storylines 5] [--languages "English, Français"] ...
+Run with --help to see all the options.
 """
 
-from datetime import datetime, timedelta
-from os import makedirs
+import os
+from argparse import ArgumentParser
+from datetime import date, timedelta
+from random import Random
 from shutil import copyfile
+from typing import Dict, List, Tuple
 
-for i in range(1, 101):
-    folder_name = f"Page {i}"
-    post_date = (datetime(2019, 1, 1) + timedelta(i - 1)).strftime("%B %d, %Y")
-    chapter_num = int((i - 1) / 20) + 1
-    makedirs("../../your_content/comics/" + folder_name)
-
-    text = f"""
-Title = Page {i}
-Post date = {post_date}
-Filename = Page_197.png
-Alt text = 
-Storyline = Chapter {chapter_num}
-"""
-    with open("../../your_content/comics/" + folder_name + "/info.ini", 'w') as f:
-        f.write(text)
-    copyfile("Page_197.png", "../../your_content/comics/" + folder_name + "/Page_197.png")
+from PIL import Image, ImageDraw
+
+from utils import str_to_list
+
+DEFAULT_COMICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "your_content", "comics")
+IMAGE_FILENAME = "page.png"
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore "
+         "magna aliqua ut enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo "
+         "consequat").split()
+
+
+def make_sentences(rng: Random, count: int) -> str:
+    sentences = []
+    for _ in range(count):
+        words = rng.choices(WORDS, k=rng.randint(6, 16))
+        sentences.append(" ".join(words).capitalize() + ".")
+    return " ".join(sentences)
+
+
+def make_image(path: str, image_size: Tuple[int, int]):
+    """
+    Creates a stand-in comic page with a few panels drawn on it. Every generated page uses a copy of this image.
+    """
+    width, height = image_size
+    im = Image.new("RGB", image_size, "white")
+    draw = ImageDraw.Draw(im)
+    panel_height = height // 3
+    for i in range(3):
+        top = i * panel_height
+        draw.rectangle((10, top + 10, width - 10, top + panel_height - 10), fill=(200, 220 - i * 40, 255),
+                       outline="black", width=4)
+    im.save(path)
+
+
+def generate_comic_pages(comics_dir: str, page_count: int = 100, storyline_count: int = 5,
+                         characters_per_page: int = 3, tags_per_page: int = 3, languages: List[str] = (),
+                         post_paragraphs: int = 2, image_size: Tuple[int, int] = (1000, 1535), seed: int = 0):
+    """
+    Generates a synthetic comic archive.
+    :param comics_dir: The folder to put the comic page folders in, usually your_content/comics
+    :param page_count: The number of comic pages to generate
+    :param storyline_count: The number of storylines to split the pages into. 0 means no storylines.
+    :param characters_per_page: The number of characters on each page. Characters are picked from a cast that's a few
+    times larger than this, so some characters show up on a lot of pages.
+    :param tags_per_page: The number of tags on each page, picked the same way as characters
+    :param languages: The languages to write a transcript in for each page, e.g. ["English", "Français"]
+    :param post_paragraphs: The number of paragraphs in each page's post text
+    :param image_size: The (width, height) of each comic image
+    :param seed: The random seed. The same settings and seed always generate the same archive.
+    :return:
+    """
+    rng = Random(seed)
+    os.makedirs(comics_dir, exist_ok=True)
+    image_path = os.path.join(comics_dir, IMAGE_FILENAME)
+    make_image(image_path, image_size)
+    cast = [f"Character {n}" for n in range(1, max(characters_per_page * 4, 1) + 1)]
+    tag_pool = [f"Tag {n}" for n in range(1, max(tags_per_page * 4, 1) + 1)]
+    # Post the last page yesterday, and one page a day before that, so no pages are scheduled for the future
+    first_post_date = date.today() - timedelta(page_count)
+    for i in range(1, page_count + 1):
+        page_dir = os.path.join(comics_dir, f"Page {i}")
+        os.makedirs(page_dir)
+        post_date = (first_post_date + timedelta(i - 1)).strftime("%B %d, %Y")
+        info = [
+            f"Title = Page {i}",
+            f"Post date = {post_date}",
+            f"Filename = {IMAGE_FILENAME}",
+            f"Alt text = {make_sentences(rng, 1)}",
+        ]
+        if storyline_count > 0:
+            chapter_num = (i - 1) * storyline_count // page_count + 1
+            info.append(f"Storyline = Chapter {chapter_num}")
+        info.append("Characters = " + ", ".join(rng.sample(cast, min(characters_per_page, len(cast)))))
+        info.append("Tags = " + ", ".join(rng.sample(tag_pool, min(tags_per_page, len(tag_pool)))))
+        with open(os.path.join(page_dir, "info.ini"), "w", encoding="utf-8") as f:
+            f.write("\n".join(info) + "\n")
+        with open(os.path.join(page_dir, "post.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(make_sentences(rng, 4) for _ in range(post_paragraphs)))
+        for language in languages:
+            with open(os.path.join(page_dir, f"{language}.txt"), "w", encoding="utf-8") as f:
+                f.write("\n".join(f"{rng.choice(cast).upper()}: {make_sentences(rng, 1)}" for _ in range(8)))
+        copyfile(image_path, os.path.join(page_dir, IMAGE_FILENAME))
+    os.remove(image_path)
+
+
+def add_generator_arguments(parser: ArgumentParser):
+    parser.add_argument("--storylines", type=int, default=5, help="Number of storylines. 0 means no storylines.")
+    parser.add_argument("--characters-per-page", type=int, default=3)
+    parser.add_argument("--tags-per-page", type=int, default=3)
+    parser.add_argument("--languages", default="English",
+                        help='Comma-separated transcript languages for each page, e.g. "English, Français"')
+    parser.add_argument("--post-paragraphs", type=int, default=2)
+    parser.add_argument("--image-size", default="1000, 1535", help='Width and height of each comic image')
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def get_generator_settings(args) -> Dict:
+    width, height = (int(n) for n in str_to_list(args.image_size))
+    return {
+        "storyline_count": args.storylines,
+        "characters_per_page": args.characters_per_page,
+        "tags_per_page": args.tags_per_page,
+        "languages": str_to_list(args.languages),
+        "post_paragraphs": args.post_paragraphs,
+        "image_size": (width, height),
+        "seed": args.seed,
+    }
+
+
+def main():
+    parser = ArgumentParser(description="Generates a synthetic comic archive for load testing")
+    parser.add_argument("--pages", type=int, default=100, help="Number of comic pages to generate")
+    parser.add_argument("--dest", default=DEFAULT_COMICS_DIR, help="Folder to generate the comic page folders in")
+    add_generator_arguments(parser)
+    args = parser.parse_args()
+    generate_comic_pages(args.dest, args.pages, **get_generator_settings(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+import os
+from configparser import RawConfigParser
+from typing import Dict, List, Optional, Set, Tuple
+
+import tracing
+from build_manifest import add_output, hash_file, hash_values
+from comic_page import ComicPage
+from content_cache import get_cached
+from content_index import file_exists
+from utils import get_worker_count, str_to_list
+
+SECTION = "Image Reprocessing"
+# Bump this whenever the way images are reprocessed changes, so images made by older versions get recreated
+IMAGE_PIPELINE_VERSION = 3
+DEFAULT_JPEG_QUALITY = 85
+DEFAULT_RESPONSIVE_QUALITY = 80
+REDUCING_GAP = 2.0
+# Where the reprocessed versions of images go when "Deduplicate images" is on. They're named after the contents of the
+# image they were made from, so pages with identical images share the same reprocessed versions.
+SHARED_IMAGE_DIRECTORY = "comic/images"
+# The names of PIL's resampling filters. PIL is slow to import, so it's only imported once an image needs to be opened.
+RESAMPLING_FILTERS = ("NEAREST", "BOX", "BILINEAR", "HAMMING", "BICUBIC", "LANCZOS")
+
+
+def get_new_size(original_size: Tuple[int, int], size: str) -> Tuple[int, int]:
+    if "," in size:
+        # Convert a string of the form "100, 36" into a 2-tuple of ints (100, 36)
+        x, y = size.strip().split(",")
+        return int(x.strip()), int(y.strip())
+    elif size.endswith("%"):
+        # Convert a percentage (50%) into a new size (50, 18)
+        size = float(size.strip().strip("%"))
+        size = size / 100
+        x, y = original_size
+        return max(1, int(x * size)), max(1, int(y * size))
+    else:
+        raise ValueError("Unknown resize value: {!r}".format(size))
+
+
+def resize(im, size, resample=None):
+    return resize_to(im, get_new_size(im.size, size), resample)
+
+
+def resize_to(im, new_size: Tuple[int, int], resample=None):
+    if resample is None:
+        from PIL import Image
+        resample = Image.LANCZOS
+    # Formats that support it (i.e. JPEG) can be decoded directly at 1/2, 1/4 or 1/8 scale, which is much faster and
+    # uses much less memory than decoding the full image. Must be called before the image data is loaded.
+    im.draft(None, (int(new_size[0] * REDUCING_GAP), int(new_size[1] * REDUCING_GAP)))
+    if im.mode in ("1", "P"):
+        # These modes can only be resized with NEAREST, so convert them to something that can be resampled properly
+        im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+    # reducing_gap shrinks the image by an integer factor first, which is much cheaper than resampling the full image
+    # with the chosen filter, and is indistinguishable from it at thumbnail sizes
+    return im.resize(new_size, resample, reducing_gap=REDUCING_GAP)
+
+
+def convert_for_jpeg(im):
+    """
+    Converts an image to a mode that can be saved as a JPEG. Transparent areas are filled in with white.
+    """
+    if im.mode in ("RGBA", "LA", "PA") or (im.mode == "P" and "transparency" in im.info):
+        from PIL import Image
+        im = im.convert("RGBA")
+        bg = Image.new("RGB", im.size, "WHITE")
+        bg.paste(im, (0, 0), im)
+        return bg
+    if im.mode not in ("RGB", "L", "CMYK"):
+        return im.convert("RGB")
+    return im
+
+
+def resize_to_dpi(im, dpi: int, resample=None):
+    """
+    Shrinks an image so it has the given DPI, based on the DPI saved in the image. Images without a DPI, or with a DPI
+    that's already at or below the given one, aren't resized.
+    """
+    source_dpi = im.info.get("dpi", (0, 0))[0]
+    if not source_dpi or source_dpi <= dpi:
+        return im
+    scale = dpi / source_dpi
+    return resize_to(im, (max(1, round(im.width * scale)), max(1, round(im.height * scale))), resample)
+
+
+def save_image(im, path, jpeg_quality=DEFAULT_JPEG_QUALITY, **params):
+    if os.path.splitext(path)[1].lower() in (".jpg", ".jpeg"):
+        convert_for_jpeg(im).save(path, quality=jpeg_quality, optimize=True, **params)
+    else:
+        im.save(path, **params)
+
+
+def get_resampling_filter(comic_info: RawConfigParser) -> str:
+    filter_name = comic_info.get(SECTION, "Resampling filter", fallback="LANCZOS").strip().upper()
+    if filter_name not in RESAMPLING_FILTERS:
+        raise ValueError("Unknown resampling filter: {!r}. Must be one of: {}".format(
+            filter_name, ", ".join(RESAMPLING_FILTERS)
+        ))
+    return filter_name
+
+
+def get_settings_key(comic_info: RawConfigParser) -> str:
+    # Any change to how images are reprocessed means every image has to be reprocessed
+    return hash_values(IMAGE_PIPELINE_VERSION, sorted(
+        (k, v) for k, v in comic_info.items(SECTION) if k != "Overwrite existing images"
+    ))
+
+
+def get_reprocessed_image_name(comic_info: RawConfigParser, manifest: Dict, comic_page_path: str) -> str:
+    """
+    Returns the path that the reprocessed versions of an image are named after. That's the image itself, unless
+    "Deduplicate images" is on, in which case it's a path in SHARED_IMAGE_DIRECTORY based on the image's contents and
+    the reprocessing settings. Identical images then get the same name, so their reprocessed versions are only made
+    once, and the names change whenever the images would come out differently.
+    """
+    if not comic_info.getboolean(SECTION, "Deduplicate images", fallback=False):
+        return comic_page_path
+    digest = hash_values(get_settings_key(comic_info), hash_file(manifest, comic_page_path))
+    return "{}/{}{}".format(SHARED_IMAGE_DIRECTORY, digest[:20], os.path.splitext(comic_page_path)[1].lower())
+
+
+def get_thumbnail_path(comic_page_path: str) -> str:
+    return os.path.splitext(comic_page_path)[0] + "_thumbnail.jpg"
+
+
+def get_low_quality_path(comic_page_path: str, file_type: str) -> str:
+    return os.path.splitext(comic_page_path)[0] + "_low_quality." + file_type.lower()
+
+
+def get_variant_path(comic_page_path: str, width: int, file_type: str) -> str:
+    return os.path.splitext(comic_page_path)[0] + f"_{width}w." + file_type.lower()
+
+
+def get_responsive_widths(comic_info: RawConfigParser) -> List[int]:
+    return sorted(set(int(w) for w in str_to_list(comic_info.get(SECTION, "Responsive image widths", fallback=""))))
+
+
+def get_image_size(path: str) -> Optional[List[int]]:
+    from PIL import Image
+    try:
+        # Opening an image only reads its header, so this doesn't decode the whole image
+        with Image.open(path) as im:
+            return list(im.size)
+    except OSError:
+        return None
+
+
+def add_image_info(comic_info: RawConfigParser, page_info_list: List[Dict], content_cache: Dict):
+    """
+    Adds the size of each comic image to its page info, so pages can reserve space for images before they load, along
+    with the sizes and paths of the responsive versions of that image that will be created, so templates and the
+    infinite scroll page can build srcset attributes. Image sizes are cached, so each image is only opened once.
+    """
+    manifest = content_cache["manifest"]
+    widths = get_responsive_widths(comic_info)
+    create_thumbnails = comic_info.getboolean(SECTION, "Create thumbnails")
+    file_type = comic_info.get(SECTION, "Responsive image file type", fallback="WEBP")
+    thumbnail_size = comic_info.get(SECTION, "Thumbnail size")
+    for page_info in page_info_list:
+        comic_page_path = f"your_content/comics/{page_info['page_name']}/{page_info['Filename']}"
+        image_size = get_cached(content_cache, "image_size:" + comic_page_path, [comic_page_path],
+                                lambda: get_image_size(comic_page_path))
+        if image_size is None:
+            continue
+        image_width, image_height = image_size
+        page_info["image_width"] = image_width
+        page_info["image_height"] = image_height
+        if not widths and not create_thumbnails:
+            continue
+        image_name = get_reprocessed_image_name(comic_info, manifest, comic_page_path)
+        if create_thumbnails:
+            page_info["thumbnail_width"] = get_new_size((image_width, image_height), thumbnail_size)[0]
+            if image_name != comic_page_path:
+                page_info["thumbnail_path"] = get_thumbnail_path(image_name)
+        # Never scale an image up
+        page_info["image_variants"] = [
+            {
+                "path": get_variant_path(image_name, width, file_type),
+                "width": width,
+                "height": max(1, round(image_height * width / image_width)),
+            }
+            for width in widths if width < image_width
+        ]
+
+
+def process_comic_image(comic_page_path: str, thumbnail_path: Optional[str], low_quality_path: Optional[str],
+                        variants: List[Dict], settings: Dict):
+    comic_page_name = os.path.splitext(os.path.basename(comic_page_path))[0]
+    page_name = os.path.basename(os.path.dirname(comic_page_path))
+    from PIL import Image
+    resample = getattr(Image, settings["resample"])
+    with Image.open(comic_page_path) as im, tracing.span("Process images", "page", page=page_name):
+        if bool(thumbnail_path) + bool(low_quality_path) + len(variants) > 1:
+            # Each version is made from the same image, so load it at full size before resize_to() can decode it at a
+            # scale that's only big enough for the first one
+            im.load()
+        if thumbnail_path:
+            print(f"Creating thumbnail for {comic_page_name}")
+            with tracing.span("Create thumbnail", path=thumbnail_path):
+                save_image(resize(im, settings["thumbnail_size"], resample), thumbnail_path,
+                           settings["jpeg_quality"])
+            tracing.count("Images written")
+        if low_quality_path:
+            print(f"Creating low quality version of {comic_page_name}")
+            dpi = settings["low_quality_dpi"]
+            with tracing.span("Create low quality version", path=low_quality_path):
+                save_image(resize_to_dpi(im, dpi, resample), low_quality_path, settings["jpeg_quality"],
+                           dpi=(dpi, dpi))
+            tracing.count("Images written")
+        for variant in variants:
+            print(f"Creating {variant['width']}px wide version of {comic_page_name}")
+            with tracing.span("Create responsive version", path=variant["path"]):
+                save_image(resize_to(im, (variant["width"], variant["height"]), resample),
+                           variant["path"], quality=settings["responsive_quality"])
+            tracing.count("Images written")
+
+
+def process_comic_image_in_worker(*job) -> Dict:
+    process_comic_image(*job)
+    # Send this image's spans back to the main process, if the build is being traced
+    return tracing.take_worker_trace()
+
+
+def needs_processing(manifest: Dict, image_path: str, key: str, overwrite: bool, checked_paths: Set[str]) -> bool:
+    """
+    Checks if a reprocessed image needs to be (re)created. Images that were created by the last build from the same
+    source image and settings are never recreated, even if "Overwrite existing images" is on.
+    :param checked_paths: The images that have already been checked by this build. Pages with identical images share
+    the same reprocessed versions when "Deduplicate images" is on, so those are only created for the first page.
+    """
+    if image_path in checked_paths:
+        return False
+    checked_paths.add(image_path)
+    if image_path.startswith(SHARED_IMAGE_DIRECTORY + "/"):
+        # Shared images are outputs of the build, so they're deleted once no page uses them anymore
+        add_output(manifest, image_path)
+    if file_exists(manifest["content_index"], image_path):
+        if manifest["previous"]["images"].get(image_path) == key:
+            manifest["images"][image_path] = key
+            return False
+        if not overwrite:
+            return False
+    manifest["images"][image_path] = key
+    return True
+
+
+def process_comic_images(comic_info: RawConfigParser, comic_pages: List[ComicPage], manifest: Dict):
+    create_thumbnails = comic_info.getboolean(SECTION, "Create thumbnails")
+    create_low_quality = comic_info.getboolean(SECTION, "Create low-quality versions of images")
+    create_variants = bool(get_responsive_widths(comic_info))
+    if not create_thumbnails and not create_low_quality and not create_variants:
+        return
+    overwrite = comic_info.getboolean(SECTION, "Overwrite existing images")
+    file_type = comic_info.get(SECTION, "Low-quality file type")
+    settings = {
+        "thumbnail_size": comic_info.get(SECTION, "Thumbnail size"),
+        "resample": get_resampling_filter(comic_info),
+        "jpeg_quality": comic_info.getint(SECTION, "JPEG quality", fallback=DEFAULT_JPEG_QUALITY),
+        "low_quality_dpi": comic_info.getint(SECTION, "Low-quality DPI"),
+        "responsive_quality": comic_info.getint(SECTION, "Responsive image quality",
+                                                fallback=DEFAULT_RESPONSIVE_QUALITY),
+    }
+    settings_key = get_settings_key(comic_info)
+    jobs = []
+    checked_paths = set()
+    for comic_page in comic_pages:
+        comic_page_path = comic_page.comic_path
+        key = hash_values(settings_key, hash_file(manifest, comic_page_path))
+        image_name = get_reprocessed_image_name(comic_info, manifest, comic_page_path)
+        thumbnail_path = comic_page.thumbnail_path if create_thumbnails else None
+        if thumbnail_path and not needs_processing(manifest, thumbnail_path, key, overwrite, checked_paths):
+            thumbnail_path = None
+        low_quality_path = get_low_quality_path(image_name, file_type) if create_low_quality else None
+        if low_quality_path and not needs_processing(manifest, low_quality_path, key, overwrite, checked_paths):
+            low_quality_path = None
+        variants = [
+            variant for variant in comic_page.image_variants
+            if needs_processing(manifest, variant["path"], key, overwrite, checked_paths)
+        ]
+        if thumbnail_path or low_quality_path or variants:
+            jobs.append((comic_page_path, thumbnail_path, low_quality_path, variants, settings))
+    print("Reprocessing {} of {} comic images...".format(len(jobs), len(comic_pages)))
+    if jobs and comic_info.getboolean(SECTION, "Deduplicate images", fallback=False):
+        os.makedirs(SHARED_IMAGE_DIRECTORY, exist_ok=True)
+    workers = get_worker_count(comic_info, "Image workers")
+    if workers > 1 and len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        # Each worker only ever has one image open, so memory use is bounded by the number of workers rather than the
+        # number of images
+        with ProcessPoolExecutor(max_workers=workers, initializer=tracing.init_worker,
+                                 initargs=(tracing.is_enabled(),)) as pool:
+            for worker_trace in pool.map(process_comic_image_in_worker, *zip(*jobs)):
+                tracing.add_worker_trace(worker_trace)
+    else:
+        for job in jobs:
+            process_comic_image(*job)
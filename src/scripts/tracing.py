@@ -0,0 +1,223 @@
+"""
+Optional tracing for the build. When it's turned on (with build_site.py --trace), each stage of the build, each page
+rendered, and each image and Markdown file processed is recorded as a span, and the spans can be saved as a Chrome trace
+(open it in chrome://tracing or https://ui.perfetto.dev) or as a plain JSON profile.
+
+When tracing is off, span() returns a shared do-nothing context manager, so normal builds pay almost nothing for it.
+"""
+
+import os
+import tracemalloc
+from collections import Counter, OrderedDict
+from contextlib import contextmanager, nullcontext
+from json import dump
+from time import perf_counter_ns
+from typing import Dict, List, Tuple
+
+# The trace for this process, or None if tracing is off
+TRACE = None
+NULL_SPAN = nullcontext()
+
+
+def start_tracing(trace_memory: bool = False):
+    """
+    Turns on tracing for this process.
+    :param trace_memory: If True, also record the peak memory used during each stage of the build with tracemalloc.
+    This slows the build down a lot, so the timings are less accurate.
+    """
+    global TRACE
+    TRACE = {
+        "start": perf_counter_ns(),
+        "stage_start": perf_counter_ns(),
+        "events": [],
+        "counts": Counter(),
+        "trace_memory": trace_memory,
+    }
+    if trace_memory:
+        tracemalloc.start()
+
+
+def stop_tracing():
+    global TRACE
+    if TRACE is not None and TRACE["trace_memory"]:
+        tracemalloc.stop()
+    TRACE = None
+
+
+def is_enabled() -> bool:
+    return TRACE is not None
+
+
+def init_worker(enabled: bool):
+    """
+    Initializer for worker processes, so pages and images processed in them are traced too
+    """
+    global TRACE
+    # Forked workers start with a copy of the main process's trace, which they shouldn't send back
+    TRACE = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    if enabled:
+        start_tracing()
+
+
+@contextmanager
+def record_span(name: str, category: str, args: Dict):
+    start = perf_counter_ns()
+    try:
+        yield
+    finally:
+        add_span(name, category, start, perf_counter_ns() - start, **args)
+
+
+def span(name: str, category: str = "operation", **args):
+    """
+    Records how long the code in a `with` block takes.
+    :param name: The name of the span, e.g. "Render comic.tpl"
+    :param category: "stage" for build stages, "page" for the work done on each comic page (these are added up for
+    the slowest pages summary), or "operation" for anything else
+    :param args: Extra info to save with the span, e.g. page="Page 1"
+    """
+    if TRACE is None:
+        return NULL_SPAN
+    return record_span(name, category, args)
+
+
+def add_span(name: str, category: str, start: int, duration: int, **args):
+    """
+    Records a span that's already finished. `start` and `duration` are in nanoseconds, from perf_counter_ns().
+    """
+    if TRACE is None:
+        return
+    TRACE["events"].append({
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        # Chrome traces use microseconds
+        "ts": (start - TRACE["start"]) / 1000,
+        "dur": duration / 1000,
+        "pid": os.getpid(),
+        "tid": os.getpid(),
+        "args": args,
+    })
+
+
+def count(name: str, n: int = 1):
+    if TRACE is not None:
+        TRACE["counts"][name] += n
+
+
+def end_stage(name: str):
+    """
+    Records a span for a stage of the build, from the end of the last stage to now.
+    """
+    if TRACE is None:
+        return
+    now = perf_counter_ns()
+    args = {}
+    if TRACE["trace_memory"]:
+        args["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+        # Python 3.9+ can reset the peak, so each stage gets its own peak instead of the peak so far
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+    add_span(name, "stage", TRACE["stage_start"], now - TRACE["stage_start"], **args)
+    TRACE["stage_start"] = now
+
+
+def take_worker_trace() -> Dict:
+    """
+    Returns the spans and counts recorded so far in this process, and forgets them. Used by worker processes to send
+    them back to the main process, which adds them to its own trace with add_worker_trace().
+    """
+    if TRACE is None:
+        return {}
+    # Worker timestamps are relative to when the worker started tracing, so make them absolute
+    events = TRACE["events"]
+    for event in events:
+        event["ts"] += TRACE["start"] / 1000
+    worker_trace = {"events": events, "counts": TRACE["counts"]}
+    TRACE["events"] = []
+    TRACE["counts"] = Counter()
+    return worker_trace
+
+
+def add_worker_trace(worker_trace: Dict):
+    if TRACE is None or not worker_trace:
+        return
+    for event in worker_trace["events"]:
+        event["ts"] -= TRACE["start"] / 1000
+    TRACE["events"].extend(worker_trace["events"])
+    TRACE["counts"].update(worker_trace["counts"])
+
+
+def get_slowest_pages(top_n: int) -> List[Tuple[str, float, Dict[str, float]]]:
+    """
+    Adds up the time spent on each comic page, across every "page" span for it.
+    :return: The `top_n` slowest pages, as (page name, total microseconds, dict of span name to microseconds)
+    """
+    pages = {}
+    for event in TRACE["events"]:
+        if event["cat"] != "page":
+            continue
+        page_spans = pages.setdefault(event["args"].get("page", ""), Counter())
+        page_spans[event["name"]] += event["dur"]
+    slowest = sorted(pages.items(), key=lambda item: sum(item[1].values()), reverse=True)[:top_n]
+    return [(page_name, sum(page_spans.values()), dict(page_spans)) for page_name, page_spans in slowest]
+
+
+def save_trace(path: str, trace_format: str = "chrome"):
+    """
+    Saves the trace to a file.
+    :param path: The file to save it to
+    :param trace_format: "chrome" for the Chrome trace event format, or "json" for a profile with the total time and
+    count of each kind of span along with every span
+    """
+    events = sorted(TRACE["events"], key=lambda event: event["ts"])
+    if trace_format == "chrome":
+        data = {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"counts": dict(TRACE["counts"])},
+        }
+    elif trace_format == "json":
+        totals = OrderedDict()
+        for event in events:
+            key = "{}: {}".format(event["cat"], event["name"])
+            span_count, total_ms = totals.get(key, (0, 0.0))
+            totals[key] = (span_count + 1, total_ms + event["dur"] / 1000)
+        data = {
+            "totals": {key: {"count": c, "total_ms": t} for key, (c, t) in totals.items()},
+            "counts": dict(TRACE["counts"]),
+            "spans": [
+                {
+                    "name": event["name"],
+                    "category": event["cat"],
+                    "start_ms": event["ts"] / 1000,
+                    "duration_ms": event["dur"] / 1000,
+                    "pid": event["pid"],
+                    "args": event["args"],
+                }
+                for event in events
+            ],
+        }
+    else:
+        raise ValueError("Unknown trace format: {!r}. Must be chrome or json".format(trace_format))
+    with open(path, "w", encoding="utf-8") as f:
+        dump(data, f)
+    print(f"Saved build trace to {path}")
+
+
+def print_trace_summary(top_n: int = 10):
+    if TRACE is None:
+        return
+    if TRACE["counts"]:
+        print("")
+        for name, n in sorted(TRACE["counts"].items()):
+            print("{}: {}".format(name, n))
+    slowest_pages = get_slowest_pages(top_n)
+    if slowest_pages:
+        print("\nSlowest {} pages:".format(len(slowest_pages)))
+        for page_name, total, page_spans in slowest_pages:
+            print("{}: {:.2f} ms ({})".format(page_name, total / 1000, ", ".join(
+                "{} {:.2f} ms".format(name, duration / 1000) for name, duration in page_spans.items()
+            )))
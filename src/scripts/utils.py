@@ -1,5 +1,20 @@
+import filecmp
 import os
 from configparser import RawConfigParser
+from contextlib import contextmanager
+from typing import Iterator, TextIO
+
+
+def str_to_list(s, delimiter=","):
+    """
+    split(), but with extra stripping of white space and leading/trailing delimiters
+    :param s:
+    :param delimiter:
+    :return:
+    """
+    if not s:
+        return []
+    return [item.strip(" ") for item in s.strip(delimiter + " ").split(delimiter)]
 
 
 def get_comic_url(comic_info: RawConfigParser):
@@ -17,4 +32,76 @@ def get_comic_url(comic_info: RawConfigParser):
             'before building your site locally. Please see the comic_git wiki for more information.'
         )
     comic_url = comic_domain + '/' + base_directory
-    return comic_url, base_directory
\ No newline at end of file
+    return comic_url, base_directory
+
+
+def get_worker_count(comic_info: RawConfigParser, option: str) -> int:
+    """
+    Reads a worker count from the [Build Settings] section. 0 means "use every CPU core", and anything missing or
+    below 0 means 1, i.e. don't use any worker processes at all.
+    """
+    workers = comic_info.getint("Build Settings", option, fallback=1)
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    return max(workers, 1)
+
+
+def get_temp_path(path: str) -> str:
+    # Include the process ID, so worker processes never write to the same temporary file
+    return "{}.{}.tmp".format(path, os.getpid())
+
+
+def remove_if_exists(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def file_has_contents(path: str, data: bytes) -> bool:
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        with open(path, "rb") as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+def write_file_if_changed(path: str, data: bytes) -> bool:
+    """
+    Writes `data` to `path`, unless the file already contains exactly that. Files are written to a temporary file
+    first, which then replaces `path`, so nothing ever sees a half-written file. Files that don't change are never
+    touched, so deploy tools and git don't have to look at them again.
+    :return: True if the file was written
+    """
+    if file_has_contents(path, data):
+        return False
+    temp_path = get_temp_path(path)
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        remove_if_exists(temp_path)
+        raise
+    return True
+
+
+@contextmanager
+def open_if_changed(path: str) -> Iterator[TextIO]:
+    """
+    Like write_file_if_changed(), for text files that are too big to build in memory first. Yields a text file to write
+    to, which replaces `path` once the `with` block finishes, unless it's the same as what's already at `path`.
+    """
+    temp_path = get_temp_path(path)
+    try:
+        with open(temp_path, "w", encoding="utf-8", newline="\n") as f:
+            yield f
+        if os.path.isfile(path) and filecmp.cmp(temp_path, path, shallow=False):
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, path)
+    except BaseException:
+        remove_if_exists(temp_path)
+        raise
@@ -0,0 +1,152 @@
+"""
+Builds your comic_git site, serves it on a local web server, and rebuilds it whenever anything in your_content or
+src/templates changes, so you can preview your changes by refreshing the page.
+
+The build stays loaded between rebuilds, along with the parsed pages, compiled templates and rendered post text, and
+only the pages affected by a change are rebuilt. Builds are always incremental in watch mode.
+
+Usage: python src/scripts/watch.py [--port 8000] [--interval 0.2] [--verbose]
+Then go to http://localhost:8000/<Comic subdirectory>/ in your browser.
+"""
+
+import os
+import traceback
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from threading import Thread
+from time import perf_counter, sleep
+from typing import Dict, List
+
+import build_site
+from content_index import scan_content_tree
+from utils import get_comic_url
+
+BUILD_ARGS = ["--incremental"]
+
+
+class PreviewRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the site from the current folder. The site's links all start with the comic subdirectory (e.g.
+    /comic_git/comic/Page-1/), like they will on GitHub Pages, so that's stripped off before looking for the file.
+    """
+    def __init__(self, *args, base_dir: str = "", **kwargs):
+        # Has to be set first, because the request is handled as soon as the handler is created
+        self.base_dir = base_dir
+        super().__init__(*args, **kwargs)
+
+    def translate_path(self, path):
+        prefix = "/" + self.base_dir
+        if self.base_dir and (path == prefix or path.startswith(prefix + "/")):
+            path = path[len(prefix):] or "/"
+        return super().translate_path(path)
+
+    def end_headers(self):
+        # Make sure the browser always shows the latest build
+        self.send_header("Cache-Control", "no-cache")
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def get_watch_roots() -> List[str]:
+    comic_info = build_site.read_info("your_content/comic_info.ini")
+    return build_site.get_content_roots(comic_info)
+
+
+def build(warm_state: Dict, verbose: bool) -> bool:
+    """
+    Runs the build. Any errors are printed instead of raised, so a mistake in a file doesn't stop the watcher.
+    :return: True if the build succeeded
+    """
+    start_time = perf_counter()
+    output = StringIO()
+    try:
+        if verbose:
+            build_site.main(BUILD_ARGS, warm_state)
+        else:
+            with redirect_stdout(output):
+                build_site.main(BUILD_ARGS, warm_state)
+    except Exception:
+        print(output.getvalue())
+        traceback.print_exc()
+        print("Build failed. Fix the error and save again to rebuild.")
+        return False
+    print("Built in {:.0f} ms".format((perf_counter() - start_time) * 1000))
+    return True
+
+
+def start_server(port: int) -> ThreadingHTTPServer:
+    comic_info = build_site.read_info("your_content/comic_info.ini")
+    _, base_dir = get_comic_url(comic_info)
+    handler = partial(PreviewRequestHandler, directory=os.getcwd(), base_dir=base_dir)
+    server = ThreadingHTTPServer(("localhost", port), handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving your comic at http://localhost:{port}/{base_dir}/")
+    return server
+
+
+def get_files_after_build(warm_state: Dict, files_before: Dict, roots: List[str]) -> Dict:
+    """
+    Returns the files to compare the next scan against. That's the files as they were when the build started, except
+    for the files the build wrote itself (e.g. thumbnails), which are taken as they are now so they don't trigger
+    another build. Anything else that was saved while the build was running still counts as changed.
+    """
+    manifest = warm_state.get("manifest")
+    if manifest is None:
+        return files_before
+    written = {os.path.normpath(path) for path in list(manifest["images"]) + list(manifest["outputs"])}
+    files = {path: stat for path, stat in files_before.items() if path not in written}
+    files.update((path, stat) for path, stat in scan_content_tree(roots)["files"].items() if path in written)
+    return files
+
+
+def watch(warm_state: Dict, last_files: Dict, interval: float, verbose: bool):
+    """
+    :param last_files: The files in the watched folders as of the last build, from get_files_after_build()
+    """
+    roots = get_watch_roots()
+    print("Watching {} for changes. Press Ctrl+C to stop.".format(", ".join(roots)))
+    while True:
+        sleep(interval)
+        content_index = scan_content_tree(roots)
+        if content_index["files"] == last_files:
+            continue
+        changed = set(content_index["files"].items()) ^ set(last_files.items())
+        changed_paths = sorted({path for path, _ in changed})
+        print("Changed: {}{}".format(", ".join(changed_paths[:3]), "..." if len(changed_paths) > 3 else ""))
+        # The build can use this scan instead of scanning everything again
+        warm_state["content_index"] = content_index
+        build(warm_state, verbose)
+        # In case the transcripts folder was changed in comic_info.ini
+        roots = get_watch_roots()
+        last_files = get_files_after_build(warm_state, content_index["files"], roots)
+
+
+def main():
+    parser = ArgumentParser(description="Serves your comic_git site locally and rebuilds it when you change it")
+    parser.add_argument("--port", type=int, default=8000, help="Port to serve the site on")
+    parser.add_argument("--interval", type=float, default=0.2, help="Seconds between checks for changes")
+    parser.add_argument("--verbose", action="store_true", help="Show the full output of each build")
+    args = parser.parse_args()
+
+    warm_state = {}
+    # Scanned before the build starts, so anything saved while it's running is picked up by the first check
+    roots = get_watch_roots()
+    files_before = scan_content_tree(roots)["files"]
+    build(warm_state, args.verbose)
+    last_files = get_files_after_build(warm_state, files_before, roots)
+    server = start_server(args.port)
+    try:
+        watch(warm_state, last_files, args.interval, args.verbose)
+    except KeyboardInterrupt:
+        print("Stopping")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
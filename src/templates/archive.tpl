@@ -21,11 +21,18 @@
         <div class="archive-grid">
         {# For loops let you take a list of a values and do something for each of those values. In this case,
            it runs through list of all the pages in a particular storyline (Chapter 1, Chapter 2, etc) and creates
-           a tiny thumbnail image with a title and post date, all of which link to that comic page if clicked. #}
+           a tiny thumbnail image with a title and post date, all of which link to that comic page if clicked.
+           If responsive versions of the comic images were created, `srcset` lets high-resolution screens use the
+           smallest of them instead of a blurry thumbnail. #}
         {%- for page in pages %}
             <a href="/{{ base_dir }}/comic/{{ page.page_name }}/">
             <div class="archive-thumbnail">
-                <div class="archive-thumbnail-page"><img src="/{{ base_dir }}/{{ page.thumbnail_path }}"></div>
+                <div class="archive-thumbnail-page"><img src="/{{ base_dir }}/{{ page.thumbnail_path }}"
+                {%- if page.thumbnail_width and page.image_variants %}
+                    srcset="/{{ base_dir }}/{{ page.thumbnail_path }} {{ page.thumbnail_width }}w
+                    {%- for variant in page.image_variants %}, /{{ base_dir }}/{{ variant.path }} {{ variant.width }}w{% endfor %}"
+                    sizes="100px"
+                {%- endif %}></div>
                 <div class="archive-thumbnail-title">{{ page.page_title }}</div>
                 <div class="archive-thumbnail-post-date">{{ page.archive_post_date }}</div>
             </div>
@@ -49,5 +56,7 @@
     {%- endfor %}
     </ul>
     {%- endif %}
+    {#- If the archive is split across more than one page, this adds links to the other pages of the archive #}
+    {%- include "pagination.tpl" %}
     </div>
 {% endblock %}
\ No newline at end of file
@@ -7,6 +7,11 @@
        next line is added to the end. #}
     {{- super() }}
     <link rel="next" href="/{{ base_dir }}/comic/{{ next_id }}/">
+    {#- If "Prefetch next page" is turned on in comic_info.ini, the browser quietly downloads the next page's HTML
+        once it's done with this one, so clicking "Next" opens it straight away. #}
+    {%- if prefetch_next_page and next_page_image %}
+    <link rel="prefetch" href="/{{ base_dir }}/comic/{{ next_id }}/">
+    {%- endif %}
 {%- endblock %}
 {# This is the start of the `content` block. It's part of the <body> of the page. This is where all the visible
    parts of the website after the links bar and before the "Powered by comic_git" footer go. #}
@@ -14,10 +19,23 @@
     {# When text is surrounded by {{ these double curly braces }}, it's representing a variable that's passed in by
        the Python script that generates the HTML file. That value is dropped into the existing HTML with no changes.
        For example, if the value passed in to `base_dir` is `comic_git`, then `/{{ base_dir }}/comic` becomes
-       `/comic_git/comic` #}
+       `/comic_git/comic`
+       If responsive versions of the comic image were created (see "Responsive image widths" in the
+       [Image Reprocessing] section of comic_info.ini), `srcset` lists all of them along with their widths, and
+       `sizes` tells the browser how wide the image will be drawn. The browser then downloads the smallest image that
+       will still look sharp on the reader's screen. #}
     <div id="comic-page">
         <a href="/{{ base_dir }}/comic/{{ next_id }}/#comic-page">
-            <img id="comic-image" src="/{{ base_dir }}/{{ comic_path }}" title="{{ alt_text }}"/>
+            <img id="comic-image" src="/{{ base_dir }}/{{ comic_path }}" title="{{ alt_text }}"
+            {#- The width and height let the browser save space for the image before it loads, so the page doesn't
+                jump around while it does. #}
+            {%- if image_width and image_height %} width="{{ image_width }}" height="{{ image_height }}"{% endif %}
+            {%- if image_variants %}
+                 srcset="
+                 {%- for variant in image_variants %}/{{ base_dir }}/{{ variant.path }} {{ variant.width }}w, {% endfor -%}
+                 /{{ base_dir }}/{{ comic_path }} {{ image_width }}w"
+                 sizes="(max-width: {{ image_width }}px) 100vw, {{ image_width }}px"
+            {%- endif %}/>
         </a>
     </div>
 
@@ -48,8 +66,9 @@
         {%- if storyline %}
             <div id="storyline">
                 {# `| replace(" ", "-")` takes the value in the variable, in this case `storyline`, and replaces all
-                   spaces with hyphens. This is important when building links to other parts of the site. #}
-                Storyline: <a href="/{{ base_dir }}/archive/#{{ storyline | replace(" ", "-") }}">{{ storyline }}</a>
+                   spaces with hyphens. This is important when building links to other parts of the site.
+                   `storyline_archive_path` is the archive page that the storyline starts on. #}
+                Storyline: <a href="/{{ base_dir }}/{{ storyline_archive_path }}#{{ storyline | replace(" ", "-") }}">{{ storyline }}</a>
             </div>
         {%- endif %}
         {%- if characters %}
@@ -84,10 +103,16 @@
                 <td id="transcript-panel">
                     <h3>Transcript</h3>
                     <div id="active-transcript">
+                    {#- Only the first transcript is included in the page. The others are left empty, and transcript.js
+                       loads them from the `data-src` file when that language is selected. #}
                     {% for language, transcript in transcripts.items() %}
+                        {%- if transcript is none %}
+                        <div class="transcript" id='{{ language }}-transcript' data-src="/{{ base_dir }}/comic/{{ page_name }}/transcripts/{{ language | urlencode }}.html"></div>
+                        {%- else %}
                         <div class="transcript" id='{{ language }}-transcript'>
                         {{ transcript }}
                         </div>
+                        {%- endif %}
                     {% endfor %}
                     </div>
                 </td>
@@ -111,4 +136,11 @@
     init();
 </script>
 {% endif %}
+{#- `tojson` turns the next page's image sources into a JavaScript object that prefetch.js can read #}
+{%- if prefetch_next_page and next_page_image %}
+<script type="module">
+    import { prefetch_image } from "/{{ base_dir }}/src/js/prefetch.js";
+    prefetch_image({{ next_page_image|tojson }});
+</script>
+{%- endif %}
 {%- endblock %}
\ No newline at end of file
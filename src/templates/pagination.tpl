@@ -0,0 +1,21 @@
+{# This template isn't a page by itself. It's included by archive.tpl and tagged.tpl to add links between the pages
+   of a long list, when "Archive page size" or "Tagged page size" is set in comic_info.ini.
+   `pagination.page_paths` is a list of the paths to every page of the list, starting with the first page. #}
+{%- if pagination and pagination.page_count > 1 %}
+    <div class="pagination">
+    {%- if pagination.page_number > 1 %}
+        <a class="pagination-previous" href="/{{ base_dir }}/{{ pagination.page_paths[pagination.page_number - 2] }}">Previous</a>
+    {%- endif %}
+    {#- `loop.index` is the number of the current loop, starting at 1 #}
+    {%- for page_path in pagination.page_paths %}
+        {%- if loop.index == pagination.page_number %}
+        <span class="pagination-current">{{ loop.index }}</span>
+        {%- else %}
+        <a href="/{{ base_dir }}/{{ page_path }}">{{ loop.index }}</a>
+        {%- endif %}
+    {%- endfor %}
+    {%- if pagination.page_number < pagination.page_count %}
+        <a class="pagination-next" href="/{{ base_dir }}/{{ pagination.page_paths[pagination.page_number] }}">Next</a>
+    {%- endif %}
+    </div>
+{%- endif %}
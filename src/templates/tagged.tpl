@@ -21,5 +21,7 @@
             {%- endfor %}
             </ul>
         </div>
+        {#- If there are too many tagged pages to fit on one page, this adds links to the other pages of the list #}
+        {%- include "pagination.tpl" %}
     </div>
 {% endblock %}
@@ -0,0 +1,72 @@
+import os
+import sys
+from configparser import RawConfigParser
+from datetime import datetime
+from glob import glob
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "scripts"))
+
+from build_manifest import load_manifest  # noqa: E402
+from build_rss_feed import build_rss_feed  # noqa: E402
+from comic_page import ComicPage  # noqa: E402
+
+COMIC_URL = "http://x.example/comic_git"
+COMIC_INFO = """
+[Comic Info]
+Comic name = Test Comic
+Description = A comic
+Author = Someone
+Comic domain = http://x.example
+Comic subdirectory = comic_git
+
+[RSS Feed]
+Build RSS feed = True
+Language = en
+Image = your_content/images/logo.png
+Image width = 100
+Image height = 100
+Archive page size = 2
+Storyline feeds = True
+"""
+ATOM_LINK = "{http://www.w3.org/2005/Atom}link"
+
+
+def make_page(number: int, storyline: str) -> ComicPage:
+    name = f"page-{number}"
+    return ComicPage(
+        page_name=name, filename="page.png", comic_path="", thumbnail_path="", alt_text="", first_id="",
+        previous_id="", current_id=name, next_id="", last_id="", page_title=f"Page {number}", post_date="",
+        post_datetime=datetime(2020, 1, number), archive_post_date="", storyline=storyline, characters=[], tags=[],
+        post_html=f"<p>Post {number}</p>", transcripts=None, image_width=None, image_height=None, image_variants=[],
+        thumbnail_width=None, storyline_archive_path="", next_page_image=None,
+    )
+
+
+def test_feed_links_resolve_under_comic_subdirectory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("GITHUB_REPOSITORY", raising=False)
+    comic_info = RawConfigParser()
+    comic_info.read_string(COMIC_INFO)
+    comic_pages = [make_page(n, "Chapter 1" if n <= 3 else "Chapter 2") for n in range(1, 6)]
+    storylines = {
+        "Chapter 1": comic_pages[:3],
+        "Chapter 2": comic_pages[3:],
+    }
+
+    build_rss_feed(comic_info, comic_pages, storylines, load_manifest(keep_outputs=False), "key", lambda pages: pages)
+
+    feed_paths = sorted(glob("feed.xml") + glob("feed/**/*.xml", recursive=True))
+    assert "feed/archive/2.xml" in feed_paths
+    assert "feed/storylines/Chapter 1/archive/1.xml" in feed_paths
+    rels = set()
+    for feed_path in feed_paths:
+        for link in ElementTree.parse(feed_path).getroot().iter(ATOM_LINK):
+            href = link.get("href")
+            rels.add(link.get("rel"))
+            assert href.startswith(COMIC_URL + "/"), href
+            assert os.path.isfile(unquote(href[len(COMIC_URL) + 1:])), href
+            if link.get("rel") == "self":
+                assert href == COMIC_URL + "/" + feed_path.replace(" ", "%20")
+    assert rels == {"self", "current", "prev-archive"}
@@ -0,0 +1,140 @@
+import os
+import sys
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from json import loads
+from threading import Thread
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "scripts"))
+
+from export_wordpress import main  # noqa: E402
+
+EXPORT_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0" xmlns:excerpt="http://wordpress.org/export/1.2/excerpt/"
+     xmlns:content="http://purl.org/rss/1.0/modules/content/" xmlns:wp="http://wordpress.org/export/1.2/">
+<channel>
+"""
+EXPORT_FOOTER = """</channel>
+</rss>
+"""
+
+
+def comic_post(post_id: int, name: str, text: str) -> str:
+    return f"""<item>
+    <title>{name} title</title>
+    <content:encoded><![CDATA[{text}]]></content:encoded>
+    <wp:post_id>{post_id}</wp:post_id>
+    <wp:post_date>2020-06-13 12:00:00</wp:post_date>
+    <wp:post_name>{name}</wp:post_name>
+    <wp:status>publish</wp:status>
+    <wp:post_type>webcomic1</wp:post_type>
+    <category domain="post_tag"><![CDATA[Tag]]></category>
+</item>
+"""
+
+
+def attachment(post_id: int, parent_id: int, name: str) -> str:
+    return f"""<item>
+    <title>{name}</title>
+    <excerpt:encoded><![CDATA[Alt text for {name}]]></excerpt:encoded>
+    <wp:post_id>{post_id}</wp:post_id>
+    <wp:post_name>{name}</wp:post_name>
+    <wp:status>inherit</wp:status>
+    <wp:post_parent>{parent_id}</wp:post_parent>
+    <wp:post_type>attachment</wp:post_type>
+    <wp:attachment_url>http://comic.example/wp-content/uploads/{name}.png</wp:attachment_url>
+</item>
+"""
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def uploads_server(tmp_path):
+    """
+    Serves tmp_path/site over HTTP, as a stand-in for the WordPress site the images are downloaded from
+    """
+    site_dir = tmp_path / "site"
+    (site_dir / "wp-content" / "uploads").mkdir(parents=True)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=str(site_dir)))
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield site_dir, "http://127.0.0.1:{}/".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def run_import(tmp_path, base_url: str):
+    return main([
+        str(tmp_path / "export.xml"),
+        "--output", str(tmp_path / "comics"),
+        "--journal", str(tmp_path / "cache" / "wordpress_import.jsonl"),
+        "--base-url", base_url,
+        "--date-format", "%B %d, %Y",
+        "--retries", "0",
+        "--timeout", "5",
+    ])
+
+
+def test_only_pages_with_images_get_a_folder(tmp_path, uploads_server):
+    site_dir, base_url = uploads_server
+    (site_dir / "wp-content" / "uploads" / "page-a.png").write_bytes(b"page a image")
+    (tmp_path / "export.xml").write_text(
+        EXPORT_HEADER +
+        comic_post(1, "page-a", "Post text for page a") +
+        attachment(11, 1, "page-a") +
+        # No image at all
+        comic_post(2, "page-b", "Post text for page b") +
+        # The image is missing from the server
+        comic_post(3, "page-c", "Post text for page c") +
+        attachment(13, 3, "page-c") +
+        EXPORT_FOOTER,
+        encoding="utf-8"
+    )
+
+    stats = run_import(tmp_path, base_url)
+
+    assert stats["imported"] == 1
+    assert stats["failed"] == 2
+    assert sorted(os.listdir(tmp_path / "comics")) == ["page-a"]
+    page_dir = tmp_path / "comics" / "page-a"
+    assert sorted(os.listdir(page_dir)) == ["info.ini", "page-a.png", "post.txt"]
+    assert (page_dir / "page-a.png").read_bytes() == b"page a image"
+    assert (page_dir / "post.txt").read_text(encoding="utf-8") == "Post text for page a"
+    info = (page_dir / "info.ini").read_text(encoding="utf-8")
+    assert "Post date = June 13, 2020\n" in info
+    assert "Alt text = Alt text for page-a\n" in info
+    assert "Tags = Tag\n" in info
+    # The spooled post text is cleaned up, and only the imported page is in the journal
+    assert sorted(os.listdir(tmp_path / "cache")) == ["wordpress_import.jsonl"]
+    journal = (tmp_path / "cache" / "wordpress_import.jsonl").read_text(encoding="utf-8").splitlines()
+    assert [loads(line)["page"] for line in journal] == ["page-a"]
+
+
+def test_rerun_skips_imported_pages_and_retries_failed_ones(tmp_path, uploads_server):
+    site_dir, base_url = uploads_server
+    (site_dir / "wp-content" / "uploads" / "page-a.png").write_bytes(b"page a image")
+    (tmp_path / "export.xml").write_text(
+        EXPORT_HEADER +
+        comic_post(1, "page-a", "Post text for page a") +
+        attachment(11, 1, "page-a") +
+        comic_post(2, "page-b", "Post text for page b") +
+        attachment(12, 2, "page-b") +
+        EXPORT_FOOTER,
+        encoding="utf-8"
+    )
+    stats = run_import(tmp_path, base_url)
+    assert (stats["imported"], stats["failed"]) == (1, 1)
+    assert not (tmp_path / "comics" / "page-b").exists()
+
+    (site_dir / "wp-content" / "uploads" / "page-b.png").write_bytes(b"page b image")
+    stats = run_import(tmp_path, base_url)
+
+    assert (stats["imported"], stats["skipped"], stats["failed"]) == (1, 1, 0)
+    assert stats["downloaded_bytes"] == len(b"page b image")
+    assert (tmp_path / "comics" / "page-b" / "post.txt").read_text(encoding="utf-8") == "Post text for page b"
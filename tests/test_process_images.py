@@ -0,0 +1,56 @@
+import os
+import sys
+
+from PIL import Image, ImageChops, ImageStat
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "scripts"))
+
+from process_images import process_comic_image  # noqa: E402
+
+SETTINGS = {
+    "thumbnail_size": "5%",
+    "resample": "LANCZOS",
+    "jpeg_quality": 85,
+    "low_quality_dpi": 200,
+    "responsive_quality": 80,
+}
+
+
+def make_jpeg(path: str, size=(4000, 3000)):
+    # Noise has detail at every scale, so decoding it at a reduced scale is easy to spot. The high DPI makes the
+    # low-quality version shrink the image.
+    Image.effect_noise(size, 64).convert("RGB").save(path, quality=95, dpi=(1600, 1600))
+
+
+def make_variant(tmp_path, width: int, height: int) -> dict:
+    return {"path": str(tmp_path / f"page_{width}w.png"), "width": width, "height": height}
+
+
+def mean_difference(path_a: str, path_b: str) -> float:
+    with Image.open(path_a) as a, Image.open(path_b) as b:
+        return max(ImageStat.Stat(ImageChops.difference(a.convert("RGB"), b.convert("RGB"))).mean)
+
+
+def test_multi_variant_jpeg_job_matches_single_variant_jobs(tmp_path):
+    source = str(tmp_path / "page.jpg")
+    make_jpeg(source)
+    sizes = [(480, 360), (1440, 1080)]
+    process_comic_image(source, None, None, [make_variant(tmp_path, w, h) for w, h in sizes], SETTINGS)
+    for width, height in sizes:
+        single_dir = tmp_path / f"single_{width}"
+        single_dir.mkdir()
+        single = make_variant(single_dir, width, height)
+        process_comic_image(source, None, None, [single], SETTINGS)
+        assert mean_difference(str(tmp_path / f"page_{width}w.png"), single["path"]) < 0.5
+
+
+def test_low_quality_and_variant_job_matches_single_variant_job(tmp_path):
+    source = str(tmp_path / "page.jpg")
+    make_jpeg(source)
+    low_quality_path = str(tmp_path / "page_low_quality.jpg")
+    process_comic_image(source, None, low_quality_path, [make_variant(tmp_path, 1440, 1080)], SETTINGS)
+    single_dir = tmp_path / "single"
+    single_dir.mkdir()
+    single = make_variant(single_dir, 1440, 1080)
+    process_comic_image(source, None, None, [single], SETTINGS)
+    assert mean_difference(str(tmp_path / "page_1440w.png"), single["path"]) < 0.5